@@ -0,0 +1,64 @@
+"""
+Compare CSR handling of a certificate restore request before and after
+parsing the CSR once per request.
+
+    python -m benchmarks.bench_csr
+"""
+
+import argparse
+import time
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+from certapi.crypto import csr_from_str, key_match
+from certapi.validators import RequestContext, validate_csr, validate_csr_common_name, \
+                               validate_csr_hash, validate_csr_signature
+
+from .common import generate_csr, generate_key, issue_cert
+
+SN = "0000000A000001F3"
+
+
+def restore_parse_twice(csr_str, cert_bytes):
+    """ The former code path: validate_csr parsed the CSR and key_match parsed
+        it again to compare public numbers with the certificate
+    """
+    csr = csr_from_str(csr_str)
+    validate_csr_common_name(csr, SN)
+    validate_csr_hash(csr)
+    validate_csr_signature(csr)
+
+    cert = x509.load_pem_x509_certificate(cert_bytes, default_backend())
+    csr = x509.load_pem_x509_csr(csr_str.encode("utf-8"), default_backend())
+    return cert.public_key().public_numbers() == csr.public_key().public_numbers()
+
+
+def restore_parse_once(csr_str, cert_bytes):
+    ctx = RequestContext(validate_csr(csr_str, SN))
+    return key_match(cert_bytes, ctx.spki)
+
+
+def measure(func, csr_str, cert_bytes, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        assert func(csr_str, cert_bytes)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for key_type in ("ec", "rsa"):
+        csr_str = generate_csr(SN, generate_key(key_type))
+        cert_bytes = issue_cert(csr_str)
+        before = measure(restore_parse_twice, csr_str, cert_bytes, args.iterations)
+        after = measure(restore_parse_once, csr_str, cert_bytes, args.iterations)
+        print("{:<4} parse twice {:>8.1f} us  parse once {:>8.1f} us  saved {:>5.1f} %".format(
+            key_type, before, after, (before - after) / before * 100))
+
+
+if __name__ == "__main__":
+    main()
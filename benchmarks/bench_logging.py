@@ -0,0 +1,77 @@
+"""
+Measure per-request cost of request/reply logging before and after lazy
+structured logging, with debug logging disabled and enabled.
+
+    python -m benchmarks.bench_logging
+"""
+
+import argparse
+import io
+import json
+import logging
+import time
+
+from certapi import create_app
+from certapi.apiv1 import log_debug_json
+from certapi.log import BackgroundQueueHandler
+
+REQ = {
+    "auth_type": "atsha",
+    "sn": "0000000A000001F3",
+    "flags": [],
+    "sid": "4cca5561cf766855a02ee33f229acf4b144fdb7988abd85fd2bad3cfe2546d9f",
+    "type": "get",
+    "csr_str": "-----BEGIN CERTIFICATE REQUEST-----\n" + "A" * 400 + "\n-----END CERTIFICATE REQUEST-----\n",
+}
+REPLY = {
+    "status": "wait",
+    "delay": 10,
+    "message": "Certification process still running, wait for 10 sec before sending another 'get' request",
+}
+
+
+def log_eager(logger):
+    """ The former log_debug_json, called for request and reply """
+    logger.debug("%s:\n%s", "Incomming connection", json.dumps(REQ, indent=2))
+    logger.debug("%s:\n%s", "Reply", json.dumps(REPLY, indent=2))
+
+
+def log_lazy(logger):
+    log_debug_json("Incomming connection", REQ)
+    log_debug_json("Reply", REPLY)
+
+
+def measure(func, logger, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(logger)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    app = create_app()
+    logger = logging.getLogger("certapi.apiv1")
+    logger.propagate = False
+    stream_handler = logging.StreamHandler(io.StringIO())
+    queue_handler = BackgroundQueueHandler([logging.StreamHandler(io.StringIO())],
+                                           maxsize=args.iterations * 2)
+
+    with app.app_context():
+        for level, handler, name in ((logging.INFO, stream_handler, "debug disabled"),
+                                     (logging.DEBUG, stream_handler, "debug, stream handler"),
+                                     (logging.DEBUG, queue_handler, "debug, queue handler")):
+            logger.setLevel(level)
+            logger.handlers = [handler]
+            before = measure(log_eager, logger, args.iterations)
+            after = measure(log_lazy, logger, args.iterations)
+            print("{:<24} eager {:>7.2f} us/request  lazy {:>7.2f} us/request".format(
+                name, before, after))
+    queue_handler.close()
+
+
+if __name__ == "__main__":
+    main()
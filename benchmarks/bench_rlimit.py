@@ -0,0 +1,40 @@
+"""
+Compare the scripted rate limiter with the legacy multi round trip one.
+
+    python -m benchmarks.bench_rlimit --rtt 0.5
+"""
+
+from certapi import create_app
+from certapi.exceptions import RequestProcessError
+from certapi.rlimit import check_rate_limit, check_rate_limit_legacy
+
+from .common import argument_parser, get_redis, measure
+
+
+def run(check, r, addresses):
+    def one(i):
+        try:
+            check(r, addresses[i % len(addresses)])
+        except RequestProcessError:
+            pass
+    return one
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--addresses", type=int, default=100,
+                        help="number of distinct client addresses")
+    args = parser.parse_args()
+
+    app = create_app({"RLIMIT_MAX_HITS": 20})
+    r = get_redis(args)
+    with app.app_context():
+        for name, check in (("legacy (GET + MULTI + EXPIRE)", check_rate_limit_legacy),
+                            ("scripted", check_rate_limit)):
+            r.flushdb()
+            addresses = ["{}-{}".format(name, i) for i in range(args.addresses)]
+            measure(name, run(check, r, addresses), r, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Helpers shared by the benchmarks.
+
+Benchmarks run against an in-process fakeredis server by default. As it has no
+network between the client and the server, a round trip time can be simulated
+with the --rtt option. Use --redis-url to benchmark against a real server.
+"""
+
+import argparse
+import statistics
+import time
+
+import redis
+
+
+def add_redis_arguments(parser):
+    parser.add_argument("--redis-url", default=None,
+                        help="real Redis server to use instead of fakeredis")
+    parser.add_argument("--rtt", type=float, default=0.0,
+                        help="simulated round trip time [ms]")
+    parser.add_argument("-n", "--iterations", type=int, default=2000)
+
+
+def counting_redis_class(base):
+    """ Create Redis client class counting (and delaying) round trips
+    """
+    class CountingPipeline(redis.client.Pipeline):
+        def execute(self, *args, **kwargs):
+            self.counter.round_trip()
+            return super().execute(*args, **kwargs)
+
+    class CountingRedis(base):
+        round_trips = 0
+        rtt = 0.0
+
+        def round_trip(self):
+            CountingRedis.round_trips += 1
+            if CountingRedis.rtt:
+                time.sleep(CountingRedis.rtt)
+
+        def execute_command(self, *args, **options):
+            self.round_trip()
+            return super().execute_command(*args, **options)
+
+        def pipeline(self, transaction=True, shard_hint=None):
+            pipe = CountingPipeline(self.connection_pool, self.response_callbacks,
+                                    transaction, shard_hint)
+            pipe.counter = self
+            return pipe
+
+    return CountingRedis
+
+
+def get_redis(args):
+    if args.redis_url:
+        cls = counting_redis_class(redis.StrictRedis)
+        client = cls.from_url(args.redis_url)
+    else:
+        import fakeredis
+        cls = counting_redis_class(fakeredis.FakeStrictRedis)
+        client = cls()
+    cls.rtt = args.rtt / 1000
+    return client
+
+
+def measure(name, func, client, iterations):
+    """ Run func `iterations` times and print ops/s, latency percentiles and
+        Redis round trips per call.
+    """
+    type(client).round_trips = 0
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        durations.append(time.perf_counter() - start)
+
+    quantiles = statistics.quantiles(durations, n=100)
+    result = {
+        "name": name,
+        "ops": iterations / sum(durations),
+        "p50_us": quantiles[49] * 1e6,
+        "p99_us": quantiles[98] * 1e6,
+        "round_trips": type(client).round_trips / iterations,
+    }
+    print("{name:<32} {ops:>10.0f} ops/s  p50 {p50_us:>8.1f} us  p99 {p99_us:>8.1f} us"
+          "  {round_trips:.2f} RTT/op".format(**result))
+    return result
+
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    add_redis_arguments(parser)
+    return parser
+
+
+def generate_key(key_type):
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if key_type == "rsa":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def generate_csr(sn, key):
+    """ Return PEM CSR for the serial number signed by the key
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+
+    csr = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, sn)])
+    ).sign(key, hashes.SHA256())
+    return csr.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+
+def issue_cert(csr_str, ca_key=None):
+    """ Return PEM certificate for the CSR issued by a (throwaway) CA
+    """
+    import datetime
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+
+    ca_key = ca_key or generate_key("ec")
+    csr = x509.load_pem_x509_csr(csr_str.encode("utf-8"))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(
+        csr.subject
+    ).issuer_name(
+        x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, "Turris")])
+    ).public_key(
+        csr.public_key()
+    ).serial_number(
+        x509.random_serial_number()
+    ).not_valid_before(
+        now
+    ).not_valid_after(
+        now + datetime.timedelta(days=90)
+    ).sign(ca_key, hashes.SHA256())
+    return cert.public_bytes(serialization.Encoding.PEM)
@@ -3,11 +3,25 @@ from logging.config import dictConfig
 from flask import Flask
 
 
-def setup_logging():
+def setup_logging(config):
     dictConfig({
         "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {
+            "default": {
+                "format": "[%(asctime)s] %(levelname)s in %(module)s: %(message)s",
+            },
+        },
+        "handlers": {
+            "background": {
+                "()": "certapi.log.BackgroundQueueHandler",
+                "maxsize": config["LOG_QUEUE_SIZE"],
+                "formatter": "default",
+            },
+        },
         "root": {
             "level": "INFO",
+            "handlers": ["background"],
         },
     })
 
@@ -22,7 +36,18 @@ def create_app(additional_config=None):
     if additional_config:
         app.config.from_mapping(additional_config)
 
-    setup_logging()
+    setup_logging(app.config)
+
+    from .authentication import CERT_KEY_PREFIX, CERT_SPKI_KEY_PREFIX
+    from .authentication import QUEUE_NAME_CERTS, QUEUE_NAME_MAILPASS
+    from .cert_cache import init_cert_cache
+    from .poll_delay import init_poll_delays
+    from .redis_pool import init_redis_pools
+    from .validators import init_csr_cache
+    init_redis_pools(app)
+    init_csr_cache(app)
+    init_cert_cache(app, (CERT_KEY_PREFIX, CERT_SPKI_KEY_PREFIX))
+    init_poll_delays(app, (QUEUE_NAME_CERTS, QUEUE_NAME_MAILPASS))
 
     from .pages import pages
     from .apiv1 import apiv1
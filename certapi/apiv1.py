@@ -1,4 +1,4 @@
-import json
+import logging
 
 import redis
 
@@ -10,18 +10,19 @@ from flask import current_app
 from flask import redirect, url_for
 
 from .authentication import process_request
+from .log import log_sampled
+from .redis_pool import get_redis_pools
 
 
 apiv1 = Blueprint("apiv1", __name__)
 
+logger = logging.getLogger(__name__)
+
 
 def _get_redis_instance(config_namespace):
-    config = current_app.config.get_namespace(config_namespace)
-    r = redis.StrictRedis(host=config.get("host"),
-                          port=config.get("port"),
-                          username=config.get("username"),
-                          password=config.get("password"))
-    return r
+    # The client itself is cheap, connections are kept in the worker's pool
+    pool = get_redis_pools(current_app).get(config_namespace)
+    return redis.StrictRedis(connection_pool=pool)
 
 
 def get_certs_redis():
@@ -37,7 +38,9 @@ def get_mailpass_redis():
 
 
 def log_debug_json(msg, msg_json):
-    current_app.logger.debug("%s:\n%s", msg, json.dumps(msg_json, indent=2))
+    # Costs a level check only unless debug logging is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        log_sampled(logger, logging.DEBUG, msg, msg_json, current_app.config["LOG_SAMPLE_RATES"])
 
 
 @apiv1.route("certs", methods=['POST'])
@@ -0,0 +1,158 @@
+"""
+ASGI variant of the API served on an asyncio Redis client.
+
+It serves the /v1 endpoints with the same replies as the Flask app, but a
+request waiting for Redis does not hold a worker, so a single process keeps
+thousands of client polls in flight. The Flask app is still created to load
+the config and to hold the extensions (pools, caches). Run it with any ASGI
+server, e.g.:
+
+    uvicorn --factory certapi.asgi:create_asgi_app
+"""
+
+import logging
+
+import redis.asyncio
+
+from . import create_app
+from .apiv1 import log_debug_json
+from .async_authentication import process_request
+from .authentication import ACTION_CERTS, ACTION_MAILPASS
+from .long_poll import get_auth_state_watcher, init_auth_state_watchers, stop_auth_state_watchers
+from .redis_pool import REDIS_NAMESPACES, init_async_redis_pools, get_async_redis_pools
+
+logger = logging.getLogger(__name__)
+
+# path: (action, Redis config namespace)
+ROUTES = {
+    "/v1": (ACTION_CERTS, "REDIS_CERTS_"),
+    "/v1/certs": (ACTION_CERTS, "REDIS_CERTS_"),
+    "/v1/mailpass": (ACTION_MAILPASS, "REDIS_MAILPASS_"),
+}
+
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+
+def is_json(content_type):
+    mimetype = content_type.partition(";")[0].strip().lower()
+    return mimetype == "application/json" or (mimetype.startswith("application/")
+                                              and mimetype.endswith("+json"))
+
+
+async def read_body(receive, max_length=None):
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if max_length is not None and len(body) > max_length:
+            raise RequestBodyTooLarge()
+    return bytes(body)
+
+
+async def send_response(send, status, body=b"", content_type="text/plain; charset=utf-8",
+                        headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class CertAPIApplication():
+    """ ASGI application of the API
+
+        Requests are processed within an app context of the Flask app, so
+        the config and extensions are available through current_app.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            with self.app.app_context():
+                await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                for config_namespace in REDIS_NAMESPACES:
+                    self.get_watcher(self.get_redis(config_namespace))
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await stop_auth_state_watchers(self.app)
+                await get_async_redis_pools(self.app).disconnect()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def get_redis(self, config_namespace):
+        pool = get_async_redis_pools(self.app).get(config_namespace)
+        return redis.asyncio.StrictRedis(connection_pool=pool)
+
+    def get_watcher(self, r):
+        if self.app.config["LONG_POLL_TIMEOUT"] > 0:
+            return get_auth_state_watcher(self.app, r)
+        return None
+
+    async def handle(self, scope, receive, send):
+        route = ROUTES.get(scope["path"])
+        if route is None:
+            await send_response(send, 404, b"Not Found")
+            return
+        if scope["method"] == "GET" and scope["path"] == "/v1":
+            # Humans are redirected to the home page
+            location = scope.get("root_path", "") + "/"
+            await send_response(send, 302, headers=[(b"location", location.encode("latin-1"))])
+            return
+        if scope["method"] != "POST":
+            await send_response(send, 405, b"Method Not Allowed", headers=[(b"allow", b"POST")])
+            return
+
+        headers = dict(scope["headers"])
+        if not is_json(headers.get(b"content-type", b"").decode("latin-1")):
+            await send_response(send, 415, b"Unsupported Media Type")
+            return
+        try:
+            body = await read_body(receive, self.app.config["MAX_CONTENT_LENGTH"])
+        except RequestBodyTooLarge:
+            await send_response(send, 413, b"Request Entity Too Large")
+            return
+        try:
+            req_json = self.app.json.loads(body)
+        except ValueError:
+            await send_response(send, 400, b"Bad Request")
+            return
+
+        action, config_namespace = route
+        client = scope.get("client")
+        try:
+            log_debug_json("Incomming connection", req_json)
+            r = self.get_redis(config_namespace)
+            reply = await process_request(req_json, r, action, client[0] if client else None,
+                                          self.get_watcher(r))
+            log_debug_json("Reply", reply)
+        except Exception:
+            logger.exception("Exception on %s [POST]", scope["path"])
+            await send_response(send, 500, b"Internal Server Error")
+            return
+
+        # Same output as jsonify() of the Flask app
+        body = "{}\n".format(self.app.json.dumps(reply, separators=(",", ":")))
+        await send_response(send, 200, body.encode("utf-8"), self.app.json.mimetype)
+
+
+def create_asgi_app(additional_config=None):
+    app = create_app(additional_config)
+    init_async_redis_pools(app)
+    init_auth_state_watchers(app)
+    return CertAPIApplication(app)
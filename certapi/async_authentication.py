@@ -0,0 +1,240 @@
+"""
+Request processing on an asyncio Redis client, used by the ASGI app.
+
+The flow is the same as in authentication.py, whose helpers, Lua scripts and
+replies are reused, only the Redis round trips are awaited. CPU-heavy work
+(CSR validation and certificate parsing) runs in the default executor so it
+does not stall other requests served by the event loop.
+"""
+
+import asyncio
+import contextlib
+import logging
+
+from flask import current_app
+
+from .authentication import ACTION_CERTS, ACTION_MAILPASS, AUTH_SCRIPT, CERTS_EXTRA_PARAMS, \
+                            DELAY_AUTH, DELAY_GET_SESSION_EXISTS, GET_STATE_SCRIPT, \
+                            QUEUE_NAME_CERTS, QUEUE_NAME_MAILPASS, AuthStateMissing, build_reply, \
+                            build_reply_auth_accepted, build_reply_auth_start, \
+                            build_reply_get_mailpass_ok, build_reply_get_ok, build_reply_get_wait, \
+                            build_spki_index, check_auth_state, check_store_auth_result, \
+                            get_auth_queue, get_auth_state_key, get_cert_key, get_cert_spki_key, \
+                            get_indexed_spki_digest, get_mailpass_key, get_queue_pushed_key, \
+                            get_session_key, \
+                            get_state_keys, new_auth_session, parse_get_state, \
+                            store_auth_script_params
+from .cert_cache import get_cert_cache
+from .crypto import cert_spki, sha256_hex
+from .exceptions import RequestConsistencyError, RequestProcessError, CertAPISystemError
+from .poll_delay import get_due_queue_monitor, get_poll_delay
+from .rlimit import RATE_LIMIT_SCRIPT, check_hits, rate_limit_script_params, rlimit_enabled
+from .validators import check_request, get_csr_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _check_request(req, action, csr_cache):
+    ctx = check_request(req, action, csr_cache)
+    if ctx.csr is not None:
+        ctx.spki  # computed here, out of the event loop
+    return ctx
+
+
+def _cert_spki_digest(cert_bytes):
+    return sha256_hex(cert_spki(cert_bytes))
+
+
+async def check_rate_limit(r, remote_addr):
+    rate_limit = r.register_script(RATE_LIMIT_SCRIPT)
+    check_hits(await rate_limit(**rate_limit_script_params(remote_addr)))
+
+
+async def create_auth_session(req, action, r, extra_params=()):
+    logger.debug("Starting authentication for sn=%s", req["sn"])
+    sid, nonce, session = new_auth_session(req, action, extra_params)
+    await r.set(get_session_key(req["sn"], sid), session,
+                ex=current_app.config["REDIS_SESSION_TIMEOUT"])
+    return build_reply_auth_start(sid, nonce)
+
+
+async def fetch_get_state(sn, sid, value_keys, r):
+    get_state = r.register_script(GET_STATE_SCRIPT)
+    return parse_get_state(await get_state(keys=get_state_keys(sn, sid, value_keys)), value_keys)
+
+
+async def get_cert_spki_digest(sn, cert_bytes, spki_index, r):
+    cert_digest = sha256_hex(cert_bytes)
+    cert_spki_digest = get_indexed_spki_digest(cert_digest, spki_index)
+    if cert_spki_digest:
+        return cert_spki_digest
+
+    cert_spki_digest = await asyncio.to_thread(_cert_spki_digest, cert_bytes)
+    await r.set(get_cert_spki_key(sn), build_spki_index(cert_digest, cert_spki_digest),
+                ex=current_app.config["REDIS_CERT_SPKI_TIMEOUT"])
+    return cert_spki_digest
+
+
+async def get_reply_delay(r, queue_name, default):
+    monitor = get_due_queue_monitor(current_app, queue_name)
+    if monitor:
+        pipe = r.pipeline(transaction=False)
+        pipe.llen(queue_name)
+        pipe.get(get_queue_pushed_key(queue_name))
+        depth, pushed = await pipe.execute()
+        monitor.add_sample(depth, int(pushed or 0))
+    return get_poll_delay(current_app, queue_name, default)
+
+
+async def process_req_get_cert(req, ctx, r):
+    logger.debug("Processing cert GET request, sn=%s, sid=%s", req["sn"], req["sid"])
+    if "renew" in req["flags"]:  # when renew is flagged we ignore cert in redis
+        return await create_auth_session(req, ACTION_CERTS, r, CERTS_EXTRA_PARAMS)
+    authenticated = False
+
+    cert_cache = get_cert_cache(current_app)
+    cached_cert = None
+    value_keys = (get_cert_key(req["sn"]), get_cert_spki_key(req["sn"]))
+    if cert_cache:
+        cache_token = cert_cache.token()
+        cached_cert = cert_cache.get(req["sn"])
+        if cached_cert:
+            value_keys = ()
+
+    session_exists, auth_state, values = await fetch_get_state(req["sn"], req["sid"],
+                                                               value_keys, r)
+
+    if session_exists:
+        try:
+            check_auth_state(req["sn"], req["sid"], auth_state)
+        except AuthStateMissing:
+            delay = await get_reply_delay(r, QUEUE_NAME_CERTS, DELAY_GET_SESSION_EXISTS)
+            return build_reply_get_wait(delay)
+        authenticated = True
+
+    if cached_cert:
+        cert_bytes, cert_spki_digest = cached_cert
+    else:
+        cert_bytes, spki_index = values
+
+    if not cert_bytes:
+        if authenticated:
+            logger.warning("Auth OK but certificate not in redis, sn=%s", req["sn"])
+        else:
+            logger.debug("Certificate not in redis, sn=%s", req["sn"])
+        return await create_auth_session(req, ACTION_CERTS, r, CERTS_EXTRA_PARAMS)
+
+    logger.debug("Certificate found in redis, sn=%s", req["sn"])
+
+    if not cached_cert:
+        cert_spki_digest = await get_cert_spki_digest(req["sn"], cert_bytes, spki_index, r)
+        if cert_cache:
+            cert_cache.set(req["sn"], (cert_bytes, cert_spki_digest), cache_token)
+
+    if cert_spki_digest != sha256_hex(ctx.spki):
+        if authenticated:
+            logger.warning("Auth OK but certificate key does not match, sn=%s", req["sn"])
+        else:
+            logger.debug("Certificate key does not match, sn=%s", req["sn"])
+        return await create_auth_session(req, ACTION_CERTS, r, CERTS_EXTRA_PARAMS)
+
+    logger.debug("Certificate restored from redis, sn=%s", req["sn"])
+    return build_reply_get_ok(cert_bytes)
+
+
+async def process_req_get_mailpass(req, r):
+    logger.debug("Processing mailpass GET request, sn=%s, sid=%s", req["sn"], req["sid"])
+
+    # No mails for B2B
+    if req["sn"][0:3] == "B2B" or req["sn"][0:3] == "b2b":
+        raise RequestProcessError("Business customers can't request mail password")
+
+    session_exists, auth_state, (secret,) = await fetch_get_state(
+        req["sn"], req["sid"], (get_mailpass_key(req["sn"]),), r
+    )
+
+    if session_exists:
+        try:
+            check_auth_state(req["sn"], req["sid"], auth_state)
+        except AuthStateMissing:
+            delay = await get_reply_delay(r, QUEUE_NAME_MAILPASS, DELAY_GET_SESSION_EXISTS)
+            return build_reply_get_wait(delay)
+    else:
+        return await create_auth_session(req, ACTION_MAILPASS, r)
+
+    if not secret:
+        logger.warning("Auth OK but secret not in redis, sn=%s", req["sn"])
+        return await create_auth_session(req, ACTION_MAILPASS, r)
+
+    logger.debug("Mailpass server from redis, sn=%s", req["sn"])
+    return build_reply_get_mailpass_ok(secret.decode("utf-8"))
+
+
+async def process_req_auth(req, action, r):
+    logger.debug("Processing AUTH request, sn=%s, sid=%s", req["sn"], req["sid"])
+
+    queue_name, extra_params = get_auth_queue(action)
+    store_auth = r.register_script(AUTH_SCRIPT)
+    code, detail = await store_auth(**store_auth_script_params(req, action, queue_name,
+                                                               extra_params))
+    check_store_auth_result(req, code, detail)
+
+    logger.debug("Signature saved for sn=%s, sid=%s", req["sn"], req["sid"])
+    return build_reply_auth_accepted(await get_reply_delay(r, queue_name, DELAY_AUTH))
+
+
+async def process_req_get(req, ctx, r, action):
+    if action == ACTION_CERTS:
+        return await process_req_get_cert(req, ctx, r)
+
+    elif action == ACTION_MAILPASS:
+        return await process_req_get_mailpass(req, r)
+
+    raise CertAPISystemError("Unknown action {}".format(action))  # should not be raised here
+
+
+async def long_poll_req_get(req, ctx, r, action, watcher, timeout):
+    """ Process 'get' request again whenever its auth_state is changed until
+        the client is not told to wait or the timeout [seconds] expires
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # Watched before the first processing so that no change is missed
+    with watcher.watch(get_auth_state_key(req["sn"], req["sid"])) as changed:
+        while True:
+            reply = await process_req_get(req, ctx, r, action)
+            timeout = deadline - loop.time()
+            if reply["status"] != "wait" or timeout <= 0 or not watcher.connected:
+                return reply
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(changed.wait(), timeout)
+            changed.clear()
+
+
+async def process_request(req, r, action, remote_addr, watcher=None):
+    try:
+        ctx = await asyncio.to_thread(_check_request, req, action, get_csr_cache(current_app))
+
+        if rlimit_enabled():
+            await check_rate_limit(r, remote_addr)
+
+        if req["type"] == "get":
+            timeout = min(req.get("long_poll", 0), current_app.config["LONG_POLL_TIMEOUT"])
+            if timeout > 0 and watcher and watcher.connected:
+                return await long_poll_req_get(req, ctx, r, action, watcher, timeout)
+            return await process_req_get(req, ctx, r, action)
+
+        elif req["type"] == "auth":
+            return await process_req_auth(req, action, r)
+
+        raise CertAPISystemError("Invalid request type {}".format(action))  # should not be raised here
+
+    except RequestProcessError as e:
+        return build_reply("fail", str(e))
+
+    except RequestConsistencyError as e:
+        return build_reply("error", str(e))
+
+    except CertAPISystemError as e:
+        logger.error(str(e))
+        return build_reply("error", "Sentinel error. Please, restart the process")
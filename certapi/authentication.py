@@ -15,15 +15,20 @@ Note on logging:
 """
 
 import json
+import logging
 import time
 
 from flask import current_app, request
 
-from .crypto import create_random_sid, create_random_nonce, key_match
+from .cert_cache import get_cert_cache
+from .crypto import create_random_sid, create_random_nonce, cert_spki, sha256_hex
 from .exceptions import RequestConsistencyError, RequestProcessError, CertAPISystemError, \
                         InvalidRedisDataError
+from .poll_delay import get_due_queue_monitor, get_poll_delay
 from .rlimit import check_rate_limit, rlimit_enabled
-from .validators import check_request, validate_auth_state, check_session
+from .validators import check_request, get_csr_cache, validate_auth_state, SESSION_PARAMS
+
+logger = logging.getLogger(__name__)
 
 DELAY_GET_SESSION_EXISTS = 10
 DELAY_AUTH = 10
@@ -32,11 +37,127 @@ DELAY_AUTH_AGAIN = 10
 QUEUE_NAME_MAILPASS = "mpr"
 QUEUE_NAME_CERTS = "csr"
 
+CERT_KEY_PREFIX = "certificate:"
+CERT_SPKI_KEY_PREFIX = "certificate_spki:"
+
 CERTS_EXTRA_PARAMS = ("csr_str",)
 
 ACTION_CERTS = "certs"
 ACTION_MAILPASS = "mailpass"
 
+# Return {session exists, auth_state, {values}}. The values are skipped when
+# the session exists but auth_state is not set yet (client is told to wait).
+#   KEYS[1] - session key, KEYS[2] - auth_state key, KEYS[3..] - value keys
+GET_STATE_SCRIPT = """
+local session_exists = redis.call("EXISTS", KEYS[1])
+local auth_state = false
+if session_exists == 1 then
+    auth_state = redis.call("GET", KEYS[2])
+    if not auth_state then
+        return {session_exists, false, {}}
+    end
+end
+if #KEYS < 3 then
+    return {session_exists, auth_state, {}}
+end
+return {session_exists, auth_state, redis.call("MGET", unpack(KEYS, 3))}
+"""
+
+# Check the auth session, save the signature and push the auth request to the
+# queue, counting the pushed requests. Return {code, detail} where code is one
+# of AUTH_* below.
+#   KEYS[1] - session key, KEYS[2] - queue name, KEYS[3] - queue counter key
+#   ARGV[1] - action, ARGV[2] - auth_type, ARGV[3] - signature,
+#   ARGV[4] - session timeout, ARGV[5] - sn, ARGV[6] - sid, ARGV[7] - timestamp
+#   ARGV[8] - count N of general session params, ARGV[9..8+N] - general session
+#   params, ARGV[9+N..] - action-specific params copied to the auth request
+AUTH_SCRIPT = """
+-- cjson may encode an empty list as an object, flags must stay a list
+local function encode_object(object)
+    local items = {}
+    for name, value in pairs(object) do
+        local encoded
+        if type(value) == "table" and next(value) == nil then
+            encoded = "[]"
+        else
+            encoded = cjson.encode(value)
+        end
+        items[#items + 1] = cjson.encode(name) .. ":" .. encoded
+    end
+    return "{" .. table.concat(items, ",") .. "}"
+end
+
+local session_json = redis.call("GET", KEYS[1])
+if not session_json then
+    return {1, ""}
+end
+local ok, session = pcall(cjson.decode, session_json)
+if not ok or type(session) ~= "table" then
+    return {2, "Invalid session"}
+end
+
+local general_count = tonumber(ARGV[8])
+local function missing_param(first, last)
+    for i = first, last do
+        if session[ARGV[i]] == nil then
+            return "Parameter " .. ARGV[i] .. " missing in session"
+        end
+    end
+end
+
+local missing = missing_param(9, 8 + general_count)
+if missing then
+    return {2, missing}
+end
+if session["action"] ~= ARGV[1] then
+    return {3, ""}
+end
+missing = missing_param(9 + general_count, #ARGV)
+if missing then
+    return {2, missing}
+end
+if session["auth_type"] ~= ARGV[2] then
+    return {4, ""}
+end
+local signature = session["signature"]
+if signature and signature ~= "" and signature ~= cjson.null then
+    return {5, ""}
+end
+
+session["signature"] = ARGV[3]
+redis.call("SETEX", KEYS[1], ARGV[4], encode_object(session))
+
+local request = {sn = ARGV[5], sid = ARGV[6], ts = tonumber(ARGV[7])}
+for _, param in ipairs({"nonce", "signature", "flags", "auth_type"}) do
+    request[param] = session[param]
+end
+for i = 9 + general_count, #ARGV do
+    request[ARGV[i]] = session[ARGV[i]]
+end
+redis.call("LPUSH", KEYS[2], encode_object(request))
+redis.call("INCR", KEYS[3])
+return {0, ""}
+"""
+
+AUTH_OK = 0
+AUTH_SESSION_MISSING = 1
+AUTH_SESSION_BROKEN = 2
+AUTH_ACTION_MISMATCH = 3
+AUTH_TYPE_MISMATCH = 4
+AUTH_SIGNATURE_SAVED = 5
+
+# Log and reply messages of AUTH_SCRIPT result codes
+AUTH_ERRORS = {
+    AUTH_SESSION_MISSING: ("Authentication session not found",
+                           "Auth session not found. Did you send 'get' request?"),
+    AUTH_ACTION_MISMATCH: ("Action does not match",
+                           "Action does not match the original one"),
+    AUTH_TYPE_MISMATCH: ("Authentication type does not match",
+                         "Auth type does not match the original one"),
+    AUTH_SIGNATURE_SAVED: ("Signature already saved",
+                           "Signature already saved"),
+}
+
 
 class AuthStateMissing(Exception):
     pass
@@ -99,13 +220,21 @@ def get_auth_state_key(sn, sid):
 
 
 def get_cert_key(sn):
-    return "certificate:{}".format(sn)
+    return "{}{}".format(CERT_KEY_PREFIX, sn)
+
+
+def get_cert_spki_key(sn):
+    return "{}{}".format(CERT_SPKI_KEY_PREFIX, sn)
 
 
 def get_mailpass_key(sn):
     return "mailpass:{}".format(sn)
 
 
+def get_queue_pushed_key(queue_name):
+    return "queue_pushed:{}".format(queue_name)
+
+
 def create_auth_session(req, action, r, extra_params=()):
     """ This function is called in case of `certs` when no certificate with
         matching public key is found in redis or in case of `mailpass` at
@@ -114,25 +243,100 @@ def create_auth_session(req, action, r, extra_params=()):
         Parameters "sn", "flags", "auth_type" and extra_params are required in
         the req dictionary
     """
-    current_app.logger.debug("Starting authentication for sn=%s", req["sn"])
+    logger.debug("Starting authentication for sn=%s", req["sn"])
+    sid, nonce, session = new_auth_session(req, action, extra_params)
+    r.setex(get_session_key(req["sn"], sid),
+            current_app.config["REDIS_SESSION_TIMEOUT"],
+            session)
+    return build_reply_auth_start(sid, nonce)
+
+
+def new_auth_session(req, action, extra_params=()):
+    """ Return sid, nonce and JSON of a new auth session
+    """
     sid = create_random_sid()
     nonce = create_random_nonce()
 
     params = ("flags", "auth_type") + extra_params
     session = {i: req[i] for i in params}
     session.update({"action": action, "nonce": nonce, "signature": ""})
+    return sid, nonce, json.dumps(session)
 
-    r.setex(get_session_key(req["sn"], sid),
-            current_app.config["REDIS_SESSION_TIMEOUT"],
-            json.dumps(session))
-    return build_reply_auth_start(sid, nonce)
+
+def fetch_get_state(sn, sid, value_keys, r):
+    """ Fetch everything needed to process 'get' request in one round trip:
+        whether the session exists, its auth_state and the values stored under
+        value_keys (certificate, mailpass). The values are not fetched while
+        the session exists without auth_state as they are not going to be used.
+    """
+    get_state = r.register_script(GET_STATE_SCRIPT)
+    return parse_get_state(get_state(keys=get_state_keys(sn, sid, value_keys)), value_keys)
+
+
+def get_state_keys(sn, sid, value_keys):
+    return [get_session_key(sn, sid), get_auth_state_key(sn, sid), *value_keys]
+
+
+def parse_get_state(result, value_keys):
+    session_exists, auth_state, values = result
+    values = [value or None for value in values] or [None] * len(value_keys)
+    return bool(session_exists), auth_state, values
+
+
+def get_cert_spki_digest(sn, cert_bytes, spki_index, r):
+    """ Return digest of the certificate public key (SPKI) to be compared with
+        the one of a CSR.
+
+        The SPKI digest of the certificate is kept in Redis along with digest
+        of the certificate itself, so that the certificate is parsed only when
+        the index is missing or stale (the CA issued a new certificate).
+    """
+    cert_digest = sha256_hex(cert_bytes)
+    cert_spki_digest = get_indexed_spki_digest(cert_digest, spki_index)
+    if cert_spki_digest:
+        return cert_spki_digest
+
+    cert_spki_digest = sha256_hex(cert_spki(cert_bytes))
+    r.set(get_cert_spki_key(sn), build_spki_index(cert_digest, cert_spki_digest),
+          ex=current_app.config["REDIS_CERT_SPKI_TIMEOUT"])
+    return cert_spki_digest
 
 
-def check_auth_state(sn, sid, r):
-    """ Get state of client authentication from Redis. If the state is broken,
-    fail, error or missing raise an exception. If everything is OK, do nothing
+def get_indexed_spki_digest(cert_digest, spki_index):
+    """ Return the SPKI digest from the index if it is the one of the
+        certificate with cert_digest, None otherwise
+    """
+    if spki_index:
+        index_cert_digest, _, cert_spki_digest = spki_index.decode("utf-8").partition(":")
+        if index_cert_digest == cert_digest:
+            return cert_spki_digest
+    return None
+
+
+def build_spki_index(cert_digest, cert_spki_digest):
+    return "{}:{}".format(cert_digest, cert_spki_digest)
+
+
+def get_reply_delay(r, queue_name, default):
+    """ Return delay before the next poll of a client whose auth request is
+        in the queue. The queue is sampled once in a while to keep track of
+        its turnaround.
+    """
+    monitor = get_due_queue_monitor(current_app, queue_name)
+    if monitor:
+        pipe = r.pipeline(transaction=False)
+        pipe.llen(queue_name)
+        pipe.get(get_queue_pushed_key(queue_name))
+        depth, pushed = pipe.execute()
+        monitor.add_sample(depth, int(pushed or 0))
+    return get_poll_delay(current_app, queue_name, default)
+
+
+def check_auth_state(sn, sid, auth_state):
+    """ Check state of client authentication fetched from Redis. If the state
+    is broken, fail, error or missing raise an exception. If everything is OK,
+    do nothing
     """
-    auth_state = r.get(get_auth_state_key(sn, sid))
     if not auth_state:
         raise AuthStateMissing()
 
@@ -146,47 +350,70 @@ def check_auth_state(sn, sid, r):
         raise CertAPISystemError("error status for auth_state sn={}, sid={},"
                                  " (message={})".format(sn, sid, auth_state["message"]))
     if auth_state["status"] == "fail":
-        current_app.logger.debug("fail status for auth_state sn=%s, sid=%s,"
-                                 " (message=%s)", sn, sid, auth_state["message"])
+        logger.debug("fail status for auth_state sn=%s, sid=%s,"
+                     " (message=%s)", sn, sid, auth_state["message"])
         raise RequestProcessError(auth_state["message"])
 
 
-def process_req_get_cert(req, r):
+def process_req_get_cert(req, ctx, r):
     """ Parameters "sn", "sid", "cert_str", "auth_type" and "flags" are
-        required in the req dictionary.
+        required in the req dictionary. The parsed CSR is taken from the
+        request context ctx.
     """
-    current_app.logger.debug("Processing cert GET request, sn=%s, sid=%s", req["sn"], req["sid"])
+    logger.debug("Processing cert GET request, sn=%s, sid=%s", req["sn"], req["sid"])
     if "renew" in req["flags"]:  # when renew is flagged we ignore cert in redis
         return create_auth_session(req, ACTION_CERTS, r, CERTS_EXTRA_PARAMS)
     authenticated = False
 
+    # Certificate and its SPKI digest are not fetched when cached
+    cert_cache = get_cert_cache(current_app)
+    cached_cert = None
+    value_keys = (get_cert_key(req["sn"]), get_cert_spki_key(req["sn"]))
+    if cert_cache:
+        cache_token = cert_cache.token()
+        cached_cert = cert_cache.get(req["sn"])
+        if cached_cert:
+            value_keys = ()
+
+    session_exists, auth_state, values = fetch_get_state(req["sn"], req["sid"], value_keys, r)
+
     # We care about authentication only when session exists
-    if r.exists(get_session_key(req["sn"], req["sid"])):
+    if session_exists:
         try:
-            check_auth_state(req["sn"], req["sid"], r)
+            check_auth_state(req["sn"], req["sid"], auth_state)
         except AuthStateMissing:
-            return build_reply_get_wait()
+            delay = get_reply_delay(r, QUEUE_NAME_CERTS, DELAY_GET_SESSION_EXISTS)
+            return build_reply_get_wait(delay)
         authenticated = True
 
-    cert_bytes = r.get(get_cert_key(req["sn"]))
+    if cached_cert:
+        cert_bytes, cert_spki_digest = cached_cert
+    else:
+        cert_bytes, spki_index = values
+
     if not cert_bytes:
         if authenticated:
-            current_app.logger.warning("Auth OK but certificate not in redis, sn=%s", req["sn"])
+            logger.warning("Auth OK but certificate not in redis, sn=%s", req["sn"])
         else:
-            current_app.logger.debug("Certificate not in redis, sn=%s", req["sn"])
+            logger.debug("Certificate not in redis, sn=%s", req["sn"])
         return create_auth_session(req, ACTION_CERTS, r, CERTS_EXTRA_PARAMS)
 
-    current_app.logger.debug("Certificate found in redis, sn=%s", req["sn"])
+    logger.debug("Certificate found in redis, sn=%s", req["sn"])
+
+    if not cached_cert:
+        cert_spki_digest = get_cert_spki_digest(req["sn"], cert_bytes, spki_index, r)
+        if cert_cache:
+            cert_cache.set(req["sn"], (cert_bytes, cert_spki_digest), cache_token)
 
     # cert and csr public key match
-    if not key_match(cert_bytes, req["csr_str"].encode("utf-8")):
+    if cert_spki_digest != sha256_hex(ctx.spki):
         if authenticated:
-            current_app.logger.warning("Auth OK but certificate key does not match, sn=%s", req["sn"])
+            logger.warning("Auth OK but certificate key does not match, sn=%s", req["sn"])
         else:
-            current_app.logger.debug("Certificate key does not match, sn=%s", req["sn"])
+            logger.debug("Certificate key does not match, sn=%s", req["sn"])
         return create_auth_session(req, ACTION_CERTS, r, CERTS_EXTRA_PARAMS)
 
-    current_app.logger.debug("Certificate restored from redis, sn=%s", req["sn"])
+    logger.debug("Certificate restored from redis, sn=%s", req["sn"])
     return build_reply_get_ok(cert_bytes)
 
 
@@ -194,126 +421,110 @@ def process_req_get_mailpass(req, r):
     """ Parameters "sn", "sid", "auth_type" and "flags" are
         required in the req dictionary.
     """
-    current_app.logger.debug("Processing mailpass GET request, sn=%s, sid=%s", req["sn"], req["sid"])
+    logger.debug("Processing mailpass GET request, sn=%s, sid=%s", req["sn"], req["sid"])
 
     # No mails for B2B
     if req["sn"][0:3] == "B2B" or req["sn"][0:3] == "b2b":
         raise RequestProcessError("Business customers can't request mail password")
 
+    session_exists, auth_state, (secret,) = fetch_get_state(req["sn"], req["sid"],
+                                                            (get_mailpass_key(req["sn"]),), r)
+
     # Authentication is mandatory here - we do not cache passwords
-    if r.exists(get_session_key(req["sn"], req["sid"])):
+    if session_exists:
         try:
-            check_auth_state(req["sn"], req["sid"], r)
+            check_auth_state(req["sn"], req["sid"], auth_state)
         except AuthStateMissing:
-            return build_reply_get_wait()
+            delay = get_reply_delay(r, QUEUE_NAME_MAILPASS, DELAY_GET_SESSION_EXISTS)
+            return build_reply_get_wait(delay)
     else:
         return create_auth_session(req, ACTION_MAILPASS, r)
 
-    secret = r.get(get_mailpass_key(req["sn"])).decode("utf-8")
     if not secret:
-        current_app.logger.warning("Auth OK but secret not in redis, sn=%s", req["sn"])
+        logger.warning("Auth OK but secret not in redis, sn=%s", req["sn"])
         return create_auth_session(req, ACTION_MAILPASS, r)
 
-    current_app.logger.debug("Mailpass server from redis, sn=%s", req["sn"])
-    return build_reply_get_mailpass_ok(secret)
+    logger.debug("Mailpass server from redis, sn=%s", req["sn"])
+    return build_reply_get_mailpass_ok(secret.decode("utf-8"))
 
 
-def get_auth_session(sn, sid, r):
-    """ Get state of client session from Redis. If the session is broken
-    or missing, return fail info.
-    """
-    session_json = r.get(get_session_key(sn, sid))
-    if not session_json:  # authentication session open / certificate creation in progress
-        current_app.logger.debug("Authentication session not found, sn=%s, sid=%s", sn, sid)
-        raise RequestProcessError("Auth session not found. Did you send 'get' request?")
+def store_auth_params(req, action, queue_name, r, extra_params=()):
+    """ This function is being called during processing auth request invoked
+        by the client. The session is checked, its signature is saved and the
+        auth request is inserted into the Redis queue along with its "action"
+        so that propriate authority (CA, Mailpass) cand handle the request.
 
-    try:
-        session = json.loads(session_json.decode("utf-8"))
-        check_session(session)
-    except (UnicodeDecodeError, json.decoder.JSONDecodeError, InvalidRedisDataError) as e:
-        raise CertAPISystemError("{} for sn={}, sid={}".format(e, sn, sid))
+        Everything is done atomically in one round trip so that any duplicate
+        auth request is detected and forbidden.
 
-    return session
+        Parameters "sn", "sid", "signature" and "auth_type" are required in
+        the req dictionary. Parameters "nonce", "signature", "flags",
+        "auth_type" and extra_params are required in the session.
+    """
+    store_auth = r.register_script(AUTH_SCRIPT)
+    code, detail = store_auth(**store_auth_script_params(req, action, queue_name, extra_params))
+    check_store_auth_result(req, code, detail)
 
 
-def store_auth_params(sn, sid, session, queue_name, r, extra_params=()):
-    """ This function is being called during processing auth request invoked
-        by the client. This function inserts the auth request into the Redis
-        queue along with its "action" so that propriate authority (CA, Mailpass)
-        cand handle the request.
+def store_auth_script_params(req, action, queue_name, extra_params=()):
+    general_params = sorted(SESSION_PARAMS)
+    return {
+        "keys": [get_session_key(req["sn"], req["sid"]), queue_name,
+                 get_queue_pushed_key(queue_name)],
+        "args": [action, req["auth_type"], req["signature"],
+                 current_app.config["REDIS_SESSION_TIMEOUT"],
+                 req["sn"], req["sid"], int(time.time()),
+                 len(general_params)] + general_params + list(extra_params),
+    }
 
-        The session (not the param) saved in Redis is being updated as well so
-        we can detect and forbid any possible duplicate auth request
-        in the future.
 
-        Parameters "nonce", "signature", "flags", "auth_type" and extra_params are
-        required in the session (the param) dictionary.
+def check_store_auth_result(req, code, detail):
+    """ Raise exception matching the AUTH_SCRIPT result code
     """
-    timestamp = int(time.time())
-
-    params = ("nonce", "signature", "flags", "auth_type") + extra_params
-    request = {i: session[i] for i in params}
-    request.update({
-        "sn": sn,
-        "ts": timestamp,
-        "sid": sid
-    })
-
-    pipe = r.pipeline(transaction=True)
-    pipe.delete(get_session_key(sn, sid))
-    pipe.setex(get_session_key(sn, sid),
-               current_app.config["REDIS_SESSION_TIMEOUT"],
-               json.dumps(session))
-    pipe.lpush(queue_name, json.dumps(request))
-    pipe.execute()
+    if code == AUTH_SESSION_BROKEN:
+        raise CertAPISystemError("{} for sn={}, sid={}".format(detail.decode("utf-8"),
+                                                               req["sn"], req["sid"]))
+    if code != AUTH_OK:
+        log_message, error_message = AUTH_ERRORS[code]
+        logger.debug("%s, sn=%s, sid=%s", log_message, req["sn"], req["sid"])
+        raise RequestProcessError(error_message)
+
+
+def get_auth_queue(action):
+    """ Return name of the queue of auth requests and the action-specific
+        session params copied to them
+    """
+    if action == ACTION_CERTS:
+        return QUEUE_NAME_CERTS, CERTS_EXTRA_PARAMS
+    if action == ACTION_MAILPASS:
+        return QUEUE_NAME_MAILPASS, ()
+    raise CertAPISystemError("Unknown action {}".format(action))
 
 
 def process_req_auth(req, action, r):
     """ Parameters "sn", "sid", "signature" and "auth_type" are
         required in the req dictionary.
     """
-    current_app.logger.debug("Processing AUTH request, sn=%s, sid=%s", req["sn"], req["sid"])
-
-    session = get_auth_session(req["sn"], req["sid"], r)
-
-    current_app.logger.debug("Authentication session found open for sn=%s, sid=%s", req["sn"], req["sid"])
-
-    if session["action"] != action:
-        current_app.logger.debug("Action does not match, sn=%s, sid=%s", req["sn"], req["sid"])
-        raise RequestProcessError("Action does not match the original one")
-
-    if session["auth_type"] != req["auth_type"]:
-        current_app.logger.debug("Authentication type does not match, sn=%s, sid=%s", req["sn"], req["sid"])
-        raise RequestProcessError("Auth type does not match the original one")
-
-    if session["signature"]:  # already authenticated
-        current_app.logger.debug("Signature already saved for sn=%s, sid=%s", req["sn"], req["sid"])
-        raise RequestProcessError("Signature already saved")
+    logger.debug("Processing AUTH request, sn=%s, sid=%s", req["sn"], req["sid"])
 
     # store authentication parameters & tell the client to ask for result later
-    current_app.logger.debug("Saving signature for sn=%s, sid=%s", req["sn"], req["sid"])
-    session["signature"] = req["signature"]
-    if action == "certs":
-        store_auth_params(req["sn"], req["sid"], session, QUEUE_NAME_CERTS, r,
-                          CERTS_EXTRA_PARAMS)
-    elif action == "mailpass":
-        store_auth_params(req["sn"], req["sid"], session, QUEUE_NAME_MAILPASS, r)
-    else:
-        raise CertAPISystemError("Unknown action {}".format(action))
+    queue_name, extra_params = get_auth_queue(action)
+    store_auth_params(req, action, queue_name, r, extra_params)
 
-    return build_reply_auth_accepted()
+    logger.debug("Signature saved for sn=%s, sid=%s", req["sn"], req["sid"])
+    return build_reply_auth_accepted(get_reply_delay(r, queue_name, DELAY_AUTH))
 
 
 def process_request(req, r, action):
     try:
-        check_request(req, action)
+        ctx = check_request(req, action, get_csr_cache(current_app))
 
         if rlimit_enabled():
             check_rate_limit(r, request.remote_addr)
 
         if req["type"] == "get":
             if action == "certs":
-                return process_req_get_cert(req, r)
+                return process_req_get_cert(req, ctx, r)
 
             elif action == "mailpass":
                 return process_req_get_mailpass(req, r)
@@ -332,5 +543,5 @@ def process_request(req, r, action):
         return build_reply("error", str(e))
 
     except CertAPISystemError as e:
-        current_app.logger.error(str(e))
+        logger.error(str(e))
         return build_reply("error", "Sentinel error. Please, restart the process")
@@ -0,0 +1,175 @@
+"""
+In-process cache of certificates kept coherent by Redis.
+
+Certificates change only when the CA issues a new one. Each worker may keep
+them in memory and rely on server-assisted client side caching: a dedicated
+RESP3 connection enables CLIENT TRACKING in broadcasting mode for the
+certificate key prefixes and a background thread evicts every key the server
+reports as modified. The cache is bypassed while the tracking connection is
+down, so a stale certificate is never served.
+"""
+
+import logging
+import os
+import threading
+
+import redis
+
+from .cache import LRUCache
+from .redis_pool import get_connection_params
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_NAME = "certapi_cert_cache"
+
+# Connection parameters of the pool, not of the connection itself
+POOL_PARAMS = ("connection_class", "max_connections", "timeout")
+
+RECONNECT_DELAY = 1  # [seconds]
+
+
+class CertificateCache():
+    """ Cache of certificate values keyed by serial number
+
+        Items are invalidated when any of the keys `prefix + sn` is modified
+        in Redis.
+    """
+    def __init__(self, connection_class, connection_kwargs, prefixes, maxsize, ttl,
+                 ping_interval):
+        self.prefixes = tuple(prefixes)
+        self.ping_interval = ping_interval
+        self._connection_class = connection_class
+        self._connection_kwargs = connection_kwargs
+        self._cache = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stopped = threading.Event()
+
+        # Increased on every invalidation, values fetched before that must
+        # not be stored
+        self.generation = 0
+        self.connected = False
+        self.invalidations = 0
+        self.reconnects = 0
+
+    def _ensure_listener(self):
+        # The listener thread does not survive fork(), start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.connected = False
+            self._cache.clear()
+            self._stopped.clear()
+            thread = threading.Thread(target=self._listen, name="certapi-cert-cache",
+                                      daemon=True)
+            thread.start()
+
+    def token(self):
+        """ Return token to be passed to set() for a value fetched from Redis
+            after this call
+        """
+        self._ensure_listener()
+        return self.generation
+
+    def get(self, sn):
+        self._ensure_listener()
+        if not self.connected:
+            return None
+        return self._cache.get(sn)
+
+    def set(self, sn, value, token):
+        with self._lock:
+            if self.connected and token == self.generation:
+                self._cache.set(sn, value)
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats.update({
+            "connected": self.connected,
+            "invalidations": self.invalidations,
+            "reconnects": self.reconnects,
+        })
+        return stats
+
+    def _invalidate(self, message):
+        # message is ["invalidate", [key, ...]] or ["invalidate", None] when
+        # the whole database was flushed
+        keys = message[1]
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            if keys is None:
+                self._cache.clear()
+                return
+            for key in keys:
+                key = key.decode("utf-8") if isinstance(key, bytes) else key
+                for prefix in self.prefixes:
+                    if key.startswith(prefix):
+                        self._cache.delete(key[len(prefix):])
+
+    def _disconnected(self):
+        with self._lock:
+            self.connected = False
+            self.generation += 1
+            self._cache.clear()
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            connection = self._connection_class(protocol=3, **self._connection_kwargs)
+            try:
+                self._track(connection)
+            except (redis.RedisError, OSError) as e:
+                logger.warning("Certificate cache tracking connection lost: %s", e)
+            finally:
+                self._disconnected()
+                connection.disconnect()
+            self._stopped.wait(RECONNECT_DELAY)
+            self.reconnects += 1
+
+    def _track(self, connection):
+        connection.connect()
+        connection._parser.set_invalidation_push_handler(self._invalidate)
+        prefix_args = []
+        for prefix in self.prefixes:
+            prefix_args += ["PREFIX", prefix]
+        connection.send_command("CLIENT", "TRACKING", "ON", "BCAST", *prefix_args)
+        if connection.read_response() not in (b"OK", "OK"):
+            raise redis.ConnectionError("Tracking not enabled")
+
+        with self._lock:
+            self.generation += 1
+            self.connected = True
+
+        awaiting_pong = False
+        while not self._stopped.is_set():
+            if connection.can_read(timeout=self.ping_interval):
+                connection.read_response(push_request=True)
+                awaiting_pong = False
+            elif awaiting_pong:
+                raise redis.ConnectionError("No reply to PING")
+            else:
+                connection.send_command("PING")
+                awaiting_pong = True
+
+
+def init_cert_cache(app, prefixes):
+    cache = None
+    if int(app.config["CERT_CACHE_SIZE"]) > 0:
+        params = get_connection_params(app.config, "REDIS_CERTS_")
+        connection_class = params.get("connection_class", redis.Connection)
+        connection_kwargs = {k: v for k, v in params.items() if k not in POOL_PARAMS}
+        cache = CertificateCache(connection_class, connection_kwargs, prefixes,
+                                 int(app.config["CERT_CACHE_SIZE"]),
+                                 app.config["CERT_CACHE_TTL"],
+                                 app.config["CERT_CACHE_PING_INTERVAL"])
+    app.extensions[EXTENSION_NAME] = cache
+
+
+def get_cert_cache(app):
+    return app.extensions.get(EXTENSION_NAME)
@@ -1,7 +1,9 @@
+import hashlib
 import os
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
 from cryptography import x509
 
 from .exceptions import RequestConsistencyError
@@ -40,10 +42,27 @@ def create_random_sid():
     return os.urandom(32).hex()
 
 
-def key_match(cert_bytes, csr_bytes):
-    """ Compare public keys of two cryptographic objects and return True if
-    they are the same, otherwise return False.
+def public_key_spki(public_key):
+    """ Return DER encoded SubjectPublicKeyInfo of the public key. It is the
+    same for the same key, no matter what object the key comes from.
+    """
+    return public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+
+
+def cert_spki(cert_bytes):
+    """ Return DER encoded SubjectPublicKeyInfo of PEM certificate
     """
     cert = x509.load_pem_x509_certificate(cert_bytes, default_backend())
-    csr = x509.load_pem_x509_csr(csr_bytes, default_backend())
-    return cert.public_key().public_numbers() == csr.public_key().public_numbers()
+    return public_key_spki(cert.public_key())
+
+
+def sha256_hex(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def key_match(cert_bytes, csr_spki):
+    """ Compare public key of PEM certificate with the DER encoded
+    SubjectPublicKeyInfo of a CSR and return True if they are the same,
+    otherwise return False.
+    """
+    return cert_spki(cert_bytes) == csr_spki
@@ -1,17 +1,51 @@
 # Redis common parameters
 REDIS_SESSION_TIMEOUT = 5*60
+# Expiration of certificate public key digests (certificate_spki:*) [seconds]
+REDIS_CERT_SPKI_TIMEOUT = 30*24*60*60
+# Connection pool, one per worker process and Redis server
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 5  # wait for a free connection [seconds]
+REDIS_SOCKET_KEEPALIVE = True
 
 # Sentinel:CA Redis database
 REDIS_CERTS_HOST = "127.0.0.1"
 REDIS_CERTS_PORT = "6379"
 REDIS_CERTS_PASSWORD = ""
+REDIS_CERTS_UNIX_SOCKET_PATH = ""  # used instead of host and port when set
 
 # Sentinel:Mailpass database
 REDIS_MAILPASS_HOST = "127.0.0.1"
 REDIS_MAILPASS_PORT = "6379"
 REDIS_MAILPASS_PASSWORD = ""
+REDIS_MAILPASS_UNIX_SOCKET_PATH = ""
 
 # Rate limiting [seconds]
 RLIMIT_BAN_TIME = 7200
 RLIMIT_WINDOW_TIME = 3600
 RLIMIT_MAX_HITS = 20
+
+# Cache of CSR validation results, one per worker process (0 disables it)
+CSR_CACHE_SIZE = 10000
+CSR_CACHE_TTL = 15*60  # [seconds]
+
+# Cache of certificates, one per worker process (0 disables it). Requires
+# Redis 6+ as it is kept coherent by server-assisted client side caching.
+CERT_CACHE_SIZE = 0
+CERT_CACHE_TTL = 60*60  # [seconds]
+CERT_CACHE_PING_INTERVAL = 30  # check of the tracking connection [seconds]
+
+# Delays of client polls adapted to the CA/Mailpass backlog [seconds]
+POLL_DELAY_MIN = 2
+POLL_DELAY_MAX = 60
+POLL_DELAY_JITTER = 0.2  # delays are randomly scaled by up to +-20 %
+POLL_DELAY_SAMPLE_INTERVAL = 5  # queue sampling, one per worker (0 disables adaptation)
+POLL_DELAY_SMOOTHING = 0.3  # weight of a new sample in moving averages
+
+# Max time a 'get' request asking for long poll waits for the result of the
+# authentication, ASGI app only (0 disables long polls) [seconds]. Requires
+# keyspace notifications enabled in Redis (notify-keyspace-events K$x).
+LONG_POLL_TIMEOUT = 60
+
+# Logging
+LOG_QUEUE_SIZE = 10000  # records waiting for the logging thread, others are dropped
+LOG_SAMPLE_RATES = {}  # share of logged records by event, e.g. {"Reply": 0.1}
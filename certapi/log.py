@@ -0,0 +1,118 @@
+"""
+Logging helpers keeping the cost of logging off the request path.
+
+    - LazyJSON serializes its data only when the record is really emitted
+    - log_sampled drops a configurable share of records of an event
+    - BackgroundQueueHandler hands records over to a listener thread, so
+      formatting and I/O never run in the request thread
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# Values of these fields are replaced by their summary when logged
+SUMMARIZED_FIELDS = {"csr_str", "cert"}
+# Values of these fields are never logged
+SECRET_FIELDS = {"secret"}
+
+
+def _summarize(name, value):
+    if name in SECRET_FIELDS:
+        return "<secret>"
+    if name in SUMMARIZED_FIELDS and isinstance(value, str):
+        digest = hashlib.sha256(value.encode("utf-8", "replace")).hexdigest()
+        return "<{} chars, sha256 {}>".format(len(value), digest[:16])
+    return value
+
+
+class LazyJSON():
+    """ Logging argument serialized to JSON only when the message is formatted.
+        Large and secret fields are summarized.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        data = self.data
+        if isinstance(data, dict):
+            data = {k: _summarize(k, v) for k, v in data.items()}
+        return json.dumps(data, separators=(",", ":"), default=str)
+
+
+def log_sampled(logger, level, event, data, sample_rates=None):
+    """ Log event along with data (as JSON) unless the level is disabled or
+        the record is dropped by sampling. sample_rates maps events to the
+        share of records to be logged (0.0 - 1.0), events not listed are
+        always logged.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rates:
+        rate = sample_rates.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+    logger.log(level, "%s: %s", event, LazyJSON(data), extra={"event": event}, stacklevel=2)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler whose records are emitted by handlers in a listener
+        thread.
+
+        The listener is started lazily in each process as threads do not
+        survive fork(). When the queue is full records are dropped rather
+        than blocking the request.
+    """
+    def __init__(self, handlers=(), maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target_handlers = list(handlers) or [logging.StreamHandler()]
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        for handler in self.target_handlers:
+            handler.setFormatter(fmt)
+
+    def _start_listener(self):
+        self._pid = os.getpid()
+        self.queue = queue.Queue(self.maxsize)
+        self._listener = logging.handlers.QueueListener(self.queue, *self.target_handlers,
+                                                        respect_handler_level=True)
+        self._listener.start()
+        atexit.register(self._stop_listener)
+
+    def _stop_listener(self):
+        if self._listener and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+
+    def prepare(self, record):
+        # Message is formatted in the listener thread, only the exception
+        # has to be rendered now as the traceback can't be kept
+        if record.exc_info:
+            record = logging.makeLogRecord(record.__dict__)
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._stop_listener()
+        super().close()
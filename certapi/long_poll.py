@@ -0,0 +1,119 @@
+"""
+Long-poll support of the ASGI app.
+
+A client may ask to wait for the result of its authentication within the
+'get' request (optional "long_poll" parameter, max seconds to wait) instead of
+polling. Waiting requests are woken up by Redis keyspace notifications of
+auth_state keys, received by one subscription per event loop and Redis
+server, so a waiting request holds neither a worker nor a Redis connection.
+
+The notifications must be enabled on the Redis server, at least for string
+commands and expirations:
+
+    notify-keyspace-events K$x
+
+Requests are answered right away (polling protocol) when the subscription is
+not established.
+"""
+
+import asyncio
+import contextlib
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_NAME = "certapi_auth_state_watchers"
+
+KEYSPACE_PATTERN = "__keyspace@*__:auth_state:*"
+
+RECONNECT_DELAY = 1  # [seconds]
+
+
+class AuthStateWatcher():
+    """ Subscription to changes of auth_state keys waking up requests
+        waiting for them
+    """
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.connected = False
+        self._waiters = {}
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    @contextlib.contextmanager
+    def watch(self, key):
+        """ Return event set whenever the key is changed
+        """
+        event = asyncio.Event()
+        waiters = self._waiters.setdefault(key, set())
+        waiters.add(event)
+        try:
+            yield event
+        finally:
+            waiters.discard(event)
+            if not waiters:
+                del self._waiters[key]
+
+    def _notify(self, key):
+        for event in self._waiters.get(key, ()):
+            event.set()
+
+    def _notify_all(self):
+        for waiters in self._waiters.values():
+            for event in waiters:
+                event.set()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(KEYSPACE_PATTERN)
+                async for message in pubsub.listen():
+                    if message["type"] == "psubscribe":
+                        self.connected = True
+                    elif message["type"] == "pmessage":
+                        # channel is __keyspace@<db>__:<key>
+                        self._notify(message["channel"].decode("utf-8").partition("__:")[2])
+            except (redis.RedisError, OSError) as e:
+                logger.warning("Auth state subscription lost: %s", e)
+            finally:
+                self.connected = False
+                self._notify_all()  # waiting requests are answered right away
+                await pubsub.aclose()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+def init_auth_state_watchers(app):
+    app.extensions[EXTENSION_NAME] = {}
+
+
+def get_auth_state_watcher(app, redis_client):
+    """ Return watcher of auth_state keys in the Redis server of redis_client,
+        one per connection pool
+    """
+    watchers = app.extensions[EXTENSION_NAME]
+    watcher = watchers.get(redis_client.connection_pool)
+    if watcher is None:
+        watcher = AuthStateWatcher(redis_client)
+        watchers[redis_client.connection_pool] = watcher
+    watcher.start()
+    return watcher
+
+
+async def stop_auth_state_watchers(app):
+    watchers = app.extensions[EXTENSION_NAME]
+    for watcher in watchers.values():
+        await watcher.stop()
+    watchers.clear()
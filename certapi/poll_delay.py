@@ -0,0 +1,113 @@
+"""
+Poll delays adapted to the backlog of the authorities (CA, Mailpass).
+
+Clients waiting for the result of their authentication are told when to poll
+again. The delay follows the expected time an auth request spends in the
+queue, estimated by Little's law from the queue depth and the rate the
+authority drains the queue at, both smoothed by EWMA. Each worker samples the
+queues at most once per interval. Delays are jittered so that clients told
+to wait at the same moment do not come back at the same moment.
+"""
+
+import random
+import threading
+import time
+
+EXTENSION_NAME = "certapi_poll_delays"
+
+
+class QueueMonitor():
+    """ Estimate of the turnaround of a queue from samples of its depth and
+        the number of items ever pushed to it
+    """
+    def __init__(self, sample_interval, smoothing, clock=time.monotonic):
+        self.sample_interval = sample_interval
+        self.smoothing = smoothing
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_sample = float("-inf")
+        self._last_sample = None  # (time, depth, pushed)
+
+        self.depth = None  # [items]
+        self.drain_rate = None  # [items/second]
+
+    def claim_sample(self):
+        """ Return True when the caller is supposed to read the queue and
+            call add_sample(), at most once per sample interval
+        """
+        now = self._clock()
+        with self._lock:
+            if now < self._next_sample:
+                return False
+            self._next_sample = now + self.sample_interval
+            return True
+
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+    def add_sample(self, depth, pushed):
+        now = self._clock()
+        with self._lock:
+            if self._last_sample is not None:
+                last_time, last_depth, last_pushed = self._last_sample
+                elapsed = now - last_time
+                # The counter of pushed items is lost e.g. when Redis is flushed
+                if elapsed > 0 and pushed >= last_pushed:
+                    drained = max(0, (pushed - last_pushed) - (depth - last_depth))
+                    self.drain_rate = self._smooth(self.drain_rate, drained / elapsed)
+            self.depth = self._smooth(self.depth, depth)
+            self._last_sample = (now, depth, pushed)
+
+    def turnaround(self):
+        """ Return expected time [seconds] an item waits in the queue or None
+            if not known yet
+        """
+        with self._lock:
+            if self.drain_rate is None:
+                return None
+            if self.drain_rate == 0:
+                return 0.0 if self.depth == 0 else float("inf")
+            return self.depth / self.drain_rate
+
+
+def poll_delay(turnaround, default, min_delay, max_delay, jitter):
+    """ Return delay [whole seconds] bounded by min_delay and max_delay and
+        randomly scaled by up to +-jitter (fraction). The default is used when
+        the turnaround is not known.
+    """
+    if turnaround is None:
+        delay = default
+    else:
+        delay = min(max(turnaround, min_delay), max_delay)
+    return max(1, round(delay * random.uniform(1 - jitter, 1 + jitter)))
+
+
+def init_poll_delays(app, queue_names):
+    monitors = {}
+    if app.config["POLL_DELAY_SAMPLE_INTERVAL"] > 0:
+        monitors = {name: QueueMonitor(app.config["POLL_DELAY_SAMPLE_INTERVAL"],
+                                       app.config["POLL_DELAY_SMOOTHING"])
+                    for name in queue_names}
+    app.extensions[EXTENSION_NAME] = monitors
+
+
+def get_queue_monitor(app, queue_name):
+    return app.extensions[EXTENSION_NAME].get(queue_name)
+
+
+def get_due_queue_monitor(app, queue_name):
+    """ Return monitor of the queue if it is to be sampled now, None otherwise
+    """
+    monitor = get_queue_monitor(app, queue_name)
+    if monitor and monitor.claim_sample():
+        return monitor
+    return None
+
+
+def get_poll_delay(app, queue_name, default):
+    monitor = get_queue_monitor(app, queue_name)
+    return poll_delay(monitor.turnaround() if monitor else None, default,
+                      app.config["POLL_DELAY_MIN"], app.config["POLL_DELAY_MAX"],
+                      app.config["POLL_DELAY_JITTER"])
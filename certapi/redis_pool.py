@@ -0,0 +1,181 @@
+"""
+Process-wide Redis connection pools.
+
+Pools are created once per worker process from the REDIS_<NAME>_* config
+namespaces. Namespaces pointing to the same server (same address and
+credentials) share one pool. After fork() the child drops the pools inherited
+from the parent and creates new ones on first use, so no socket is ever shared
+between processes.
+"""
+
+import os
+import threading
+import weakref
+
+import redis
+import redis.asyncio
+
+EXTENSION_NAME = "certapi_redis_pools"
+ASYNC_EXTENSION_NAME = "certapi_async_redis_pools"
+
+REDIS_NAMESPACES = ("REDIS_CERTS_", "REDIS_MAILPASS_")
+
+
+class StatsConnectionPool(redis.BlockingConnectionPool):
+    """ Blocking connection pool counting its connections
+    """
+    def reset(self):
+        self.created_connections = 0
+        self.in_use_connections = 0
+        super().reset()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        self.created_connections += 1
+        return connection
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+        self.in_use_connections += 1
+        return connection
+
+    def release(self, connection):
+        if self.in_use_connections > 0:
+            self.in_use_connections -= 1
+        super().release(connection)
+
+    def stats(self):
+        return {
+            "max_connections": self.max_connections,
+            "created_connections": self.created_connections,
+            "in_use_connections": self.in_use_connections,
+            "idle_connections": self.created_connections - self.in_use_connections,
+        }
+
+
+def get_connection_params(config, namespace):
+    """ Build connection pool keyword arguments for the config namespace
+    """
+    ns_config = config.get_namespace(namespace)
+    params = {
+        "username": ns_config.get("username") or None,
+        "password": ns_config.get("password") or None,
+        "max_connections": int(config["REDIS_MAX_CONNECTIONS"]),
+        "timeout": config["REDIS_POOL_TIMEOUT"],
+    }
+    if ns_config.get("unix_socket_path"):
+        params.update({
+            "connection_class": redis.UnixDomainSocketConnection,
+            "path": ns_config["unix_socket_path"],
+        })
+    else:
+        params.update({
+            "host": ns_config.get("host"),
+            "port": int(ns_config.get("port")),
+            "socket_keepalive": bool(config["REDIS_SOCKET_KEEPALIVE"]),
+        })
+    return params
+
+
+class RedisPools:
+    """ Connection pools of a single application
+
+        Pools are created lazily and re-created in the child process after
+        fork(). Pools of namespaces with identical connection parameters are
+        shared.
+    """
+    def __init__(self, config, namespaces=REDIS_NAMESPACES):
+        self._params = {ns: get_connection_params(config, ns) for ns in namespaces}
+        self._reset()
+
+        # Python-level fork() (e.g. gunicorn) resets pools eagerly, forks done
+        # outside of Python (e.g. uWSGI) are caught by the pid check in get()
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() and ref()._reset())
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def get(self, namespace):
+        if self._pid != os.getpid():
+            self._reset()
+
+        pool = self._pools.get(namespace)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(namespace)
+                if pool is None:
+                    pool = self._create_pool(namespace)
+        return pool
+
+    def _create_pool(self, namespace):
+        params = self._params[namespace]
+        for ns, pool in self._pools.items():
+            if self._params[ns] == params:
+                break
+        else:
+            pool = StatsConnectionPool(**params)
+
+        self._pools[namespace] = pool
+        return pool
+
+    def stats(self):
+        return {ns: pool.stats() for ns, pool in self._pools.items()}
+
+    def disconnect(self):
+        for pool in set(self._pools.values()):
+            pool.disconnect()
+
+
+class AsyncRedisPools:
+    """ asyncio connection pools of a single application
+
+        The pools are bound to the event loop of the first request, which is
+        the only loop of an ASGI worker process.
+    """
+    def __init__(self, config, namespaces=REDIS_NAMESPACES):
+        self._params = {ns: self._async_params(get_connection_params(config, ns))
+                        for ns in namespaces}
+        self._pools = {}
+
+    @staticmethod
+    def _async_params(params):
+        params = dict(params)
+        if params.get("connection_class") is redis.UnixDomainSocketConnection:
+            params["connection_class"] = redis.asyncio.UnixDomainSocketConnection
+        return params
+
+    def get(self, namespace):
+        pool = self._pools.get(namespace)
+        if pool is None:
+            params = self._params[namespace]
+            for ns, pool in self._pools.items():
+                if self._params[ns] == params:
+                    break
+            else:
+                pool = redis.asyncio.BlockingConnectionPool(**params)
+            self._pools[namespace] = pool
+        return pool
+
+    async def disconnect(self):
+        for pool in set(self._pools.values()):
+            await pool.disconnect()
+        self._pools = {}
+
+
+def init_redis_pools(app):
+    app.extensions[EXTENSION_NAME] = RedisPools(app.config)
+
+
+def get_redis_pools(app):
+    return app.extensions[EXTENSION_NAME]
+
+
+def init_async_redis_pools(app):
+    app.extensions[ASYNC_EXTENSION_NAME] = AsyncRedisPools(app.config)
+
+
+def get_async_redis_pools(app):
+    return app.extensions[ASYNC_EXTENSION_NAME]
@@ -3,14 +3,42 @@ from flask import current_app
 
 from .exceptions import RequestProcessError
 
+# Count one hit and return the number of hits in the current window. The
+# window starts with the first hit and is not prolonged by further hits. When
+# the hits exceed the limit, the key expiration is set to the ban time once;
+# requests during the ban are not counted.
+#   KEYS[1] - rate limit key
+#   ARGV[1] - max hits, ARGV[2] - window time, ARGV[3] - ban time
+RATE_LIMIT_SCRIPT = """
+local hits = tonumber(redis.call("GET", KEYS[1]) or 0)
+if hits > tonumber(ARGV[1]) then
+    return hits
+end
+
+hits = redis.call("INCR", KEYS[1])
+if hits > tonumber(ARGV[1]) then
+    redis.call("EXPIRE", KEYS[1], ARGV[3])
+elseif hits == 1 or redis.call("TTL", KEYS[1]) < 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+return hits
+"""
+
+
+def get_rate_limit_key(remote_addr):
+    return "rate-limit:{}".format(remote_addr)
+
 
 class RLimit():
+    """ Rate limiter doing up to three round trips to Redis per request. It is
+        superseded by check_rate_limit and kept for comparison in benchmarks.
+    """
     def __init__(self, redis, remote_addr):
         self.redis = redis
         self.ban_time = current_app.config["RLIMIT_BAN_TIME"]
         self.window_time = current_app.config["RLIMIT_WINDOW_TIME"]
         self.max_hits = current_app.config["RLIMIT_MAX_HITS"]
-        self.key = "rate-limit:{}".format(remote_addr)
+        self.key = get_rate_limit_key(remote_addr)
 
         self.hits = self._get_hits()
 
@@ -39,6 +67,28 @@ class RLimit():
 
 
 def check_rate_limit(redis, remote_addr):
+    """ Count the request and deny access when the limit is reached, all in
+        one atomic round trip to Redis.
+    """
+    rate_limit = redis.register_script(RATE_LIMIT_SCRIPT)
+    check_hits(rate_limit(**rate_limit_script_params(remote_addr)))
+
+
+def rate_limit_script_params(remote_addr):
+    return {
+        "keys": [get_rate_limit_key(remote_addr)],
+        "args": [int(current_app.config["RLIMIT_MAX_HITS"]),
+                 current_app.config["RLIMIT_WINDOW_TIME"],
+                 current_app.config["RLIMIT_BAN_TIME"]],
+    }
+
+
+def check_hits(hits):
+    if int(hits) > int(current_app.config["RLIMIT_MAX_HITS"]):
+        raise RequestProcessError("You hit the rate limit")
+
+
+def check_rate_limit_legacy(redis, remote_addr):
     rl = RLimit(redis, remote_addr)
 
     if rl.reached_enough_hits():
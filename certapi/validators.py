@@ -1,4 +1,8 @@
-from .crypto import AVAIL_HASHES, get_common_names, csr_from_str
+import hashlib
+from functools import cached_property
+
+from .cache import LRUCache
+from .crypto import AVAIL_HASHES, get_common_names, csr_from_str, public_key_spki
 from .exceptions import RequestConsistencyError, InvalidRedisDataError
 
 #  Available flags for get (cert) request from clients
@@ -45,6 +49,9 @@ GET_CERT_REQ_PARAMS = {
 AUTH_REQ_PARAMS = {
     "signature",
 }
+# Name of the application extension holding cache of CSR validation results
+CSR_CACHE_EXTENSION_NAME = "certapi_csr_cache"
+
 # Length of signature computed by atsha / otp devices
 SIGNATURE_LENGTH = {
     "atsha": 64,
@@ -53,6 +60,22 @@ SIGNATURE_LENGTH = {
 }
 
 
+class RequestContext():
+    """ Data parsed from the client request during its validation, so that
+        nothing needs to be parsed again while the request is processed.
+    """
+    def __init__(self, csr=None):
+        self.csr = csr
+
+    @cached_property
+    def public_key(self):
+        return self.csr.public_key()
+
+    @cached_property
+    def spki(self):
+        return public_key_spki(self.public_key)
+
+
 def validate_sn_turris(sn):
     """Check serial number format of Turris 1.x and Turris Omnia devices
     using atsha and Turris MOX using otp.
@@ -109,11 +132,49 @@ def validate_csr_signature(csr):
         raise RequestConsistencyError("Request signature is not valid")
 
 
-def validate_csr(csr_str, sn):
+def validate_csr(csr_str, sn, cache=None):
+    """ Validate the CSR and return it parsed. Results of the validation,
+        both positive and negative, are kept in the cache (LRUCache) if
+        provided, as clients keep sending the same CSR in each request.
+    """
+    if cache is None:
+        return _validate_csr(csr_str, sn)
+
+    try:
+        key = (hashlib.sha256(csr_str.encode("utf-8")).digest(), sn)
+    except (AttributeError, UnicodeEncodeError):
+        return _validate_csr(csr_str, sn)
+
+    result = cache.get(key)
+    if result is None:
+        try:
+            result = _validate_csr(csr_str, sn)
+        except RequestConsistencyError as e:
+            result = e
+        cache.set(key, result)
+
+    if isinstance(result, RequestConsistencyError):
+        raise RequestConsistencyError(str(result))
+    return result
+
+
+def _validate_csr(csr_str, sn):
     csr = csr_from_str(csr_str)
     validate_csr_common_name(csr, sn)
     validate_csr_hash(csr)
     validate_csr_signature(csr)
+    return csr
+
+
+def init_csr_cache(app):
+    cache = None
+    if int(app.config["CSR_CACHE_SIZE"]) > 0:
+        cache = LRUCache(int(app.config["CSR_CACHE_SIZE"]), app.config["CSR_CACHE_TTL"])
+    app.extensions[CSR_CACHE_EXTENSION_NAME] = cache
+
+
+def get_csr_cache(app):
+    return app.extensions.get(CSR_CACHE_EXTENSION_NAME)
 
 
 def validate_certs_flags(flags):
@@ -122,6 +183,12 @@ def validate_certs_flags(flags):
             raise RequestConsistencyError("Flag not available: {}".format(flag))
 
 
+def validate_long_poll(long_poll):
+    # bool is int as well
+    if type(long_poll) is not int or long_poll < 0:
+        raise RequestConsistencyError("Bad format of long_poll: {}".format(long_poll))
+
+
 def validate_sid(sid):
     if sid == "":
         return
@@ -177,7 +244,10 @@ def check_params_exist(req, params):
             )
 
 
-def check_request(req, action):
+def check_request(req, action, csr_cache=None):
+    """ Validate the request and return its RequestContext. Results of CSR
+        validation are cached in csr_cache if provided.
+    """
     if type(req) is not dict:
         raise RequestConsistencyError(
             "Request not a valid JSON with correct content type"
@@ -187,12 +257,15 @@ def check_request(req, action):
     validate_sn = sn_validators[req["auth_type"]]
     validate_sn(req["sn"])
     validate_sid(req["sid"])
+    ctx = RequestContext()
 
     if req["type"] == "get":
         check_params_exist(req, GET_REQ_PARAMS)
+        if "long_poll" in req:
+            validate_long_poll(req["long_poll"])
         if action == "certs":
             check_params_exist(req, GET_CERT_REQ_PARAMS)
-            validate_csr(req["csr_str"], req["sn"])
+            ctx.csr = validate_csr(req["csr_str"], req["sn"], csr_cache)
             validate_certs_flags(req["flags"])
 
             if "renew" in req["flags"] and req["sid"]:
@@ -204,3 +277,5 @@ def check_request(req, action):
 
     else:
         raise RequestConsistencyError("Invalid request type: {}".format(req["type"]))
+
+    return ctx
@@ -13,7 +13,7 @@ setup(
     author="CZ.NIC, z.s.p.o.",
     author_email="packaging@turris.cz",
     url="https://gitlab.nic.cz/turris/sentinel/cert-api",
-    packages=find_packages(exclude=("tests*",)),
+    packages=find_packages(exclude=("tests*", "benchmarks*")),
     install_requires=[
         "flask",
         "python-dotenv",
@@ -25,6 +25,7 @@ setup(
             "pytest",
             "coverage",
             "pytest-cov",
+            "fakeredis[lua]",
         ],
     },
 )
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+from unittest.mock import patch
+
+from certapi.asgi import create_asgi_app
+from tests.client.conftest import good_certs, good_reqs_auth, good_reqs_get_cert, good_sessions
+
+
+class Response():
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def get_json(self):
+        return json.loads(self.body)
+
+
+async def call(app, method, path, body=b"", content_type="application/json",
+               client=("10.0.0.1", 40000)):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "root_path": "",
+        "headers": [(b"content-type", content_type.encode("latin-1"))],
+        "client": client,
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start, body_message = sent
+    return Response(start["status"], dict(start["headers"]), body_message["body"])
+
+
+def post(app, path, req, **kwargs):
+    return asyncio.run(call(app, "POST", path, json.dumps(req).encode("utf-8"), **kwargs))
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def fake_redis(redis_server):
+    return fakeredis.FakeStrictRedis(server=redis_server)
+
+
+@pytest.fixture
+def asgi_app(redis_server):
+    app = create_asgi_app({"RLIMIT_MAX_HITS": 0})
+    with patch("redis.asyncio.StrictRedis", return_value=fakeredis.FakeAsyncRedis(server=redis_server)):
+        yield app
+
+
+@pytest.fixture
+def flask_client(asgi_app, fake_redis):
+    with patch("redis.StrictRedis", return_value=fake_redis):
+        with asgi_app.app.test_client() as client:
+            yield client
+
+
+@pytest.fixture(params=zip(good_reqs_get_cert, good_certs))
+def good_data(request):
+    return request.param
+
+
+@pytest.fixture(params=zip(good_reqs_auth, good_sessions))
+def good_req_auth_data(request):
+    return request.param
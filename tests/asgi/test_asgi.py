@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from certapi.authentication import get_cert_key, get_session_key, get_auth_state_key
+
+from .conftest import call, post
+
+
+def test_get_cert_no_session(asgi_app, fake_redis, good_data):
+    req = dict(good_data[0], sid="")
+    rv = post(asgi_app, "/v1/certs", req)
+    assert rv.status == 200
+    assert rv.headers[b"content-type"] == b"application/json"
+    resp_data = rv.get_json()
+    assert resp_data["status"] == "authenticate"
+
+    session = json.loads(fake_redis.get(get_session_key(req["sn"], resp_data["sid"])))
+    assert session["nonce"] == resp_data["nonce"]
+    assert session["csr_str"] == req["csr_str"]
+
+
+def test_get_cert_ok(asgi_app, fake_redis, good_data):
+    req, cert = good_data
+    fake_redis.set(get_cert_key(req["sn"]), cert)
+    rv = post(asgi_app, "/v1", req)
+    assert rv.get_json()["status"] == "ok"
+    assert rv.get_json()["cert"] == cert
+    assert fake_redis.exists("certificate_spki:{}".format(req["sn"]))  # index stored
+
+    rv = post(asgi_app, "/v1", req)  # served using the index
+    assert rv.get_json()["cert"] == cert
+
+
+def test_auth(asgi_app, fake_redis, good_req_auth_data):
+    req, session = good_req_auth_data
+    fake_redis.set(get_session_key(req["sn"], req["sid"]), json.dumps(session))
+    assert post(asgi_app, "/v1", req).get_json()["status"] == "accepted"
+    assert fake_redis.llen("csr") == 1
+
+    assert post(asgi_app, "/v1", req).get_json()["status"] == "fail"  # duplicate
+    assert fake_redis.llen("csr") == 1
+
+
+def test_same_replies_as_flask(asgi_app, flask_client, fake_redis, good_data):
+    req, cert = good_data
+    asgi_app.app.config["POLL_DELAY_JITTER"] = 0
+    fake_redis.set(get_session_key(req["sn"], req["sid"]), b"{}")
+    fake_redis.set(get_cert_key(req["sn"]), cert)
+
+    # wait, ok and fail replies, then an error for each
+    for auth_state in (None, b'{"status": "ok", "message": null}',
+                       b'{"status": "fail", "message": "Bad signature"}'):
+        if auth_state:
+            fake_redis.set(get_auth_state_key(req["sn"], req["sid"]), auth_state)
+        for request_data in (req, dict(req, sn="x")):
+            expected = flask_client.post("/v1", json=request_data)
+            rv = post(asgi_app, "/v1", request_data)
+            assert (rv.status, rv.body) == (expected.status_code, expected.get_data())
+
+
+def test_rate_limit(asgi_app, good_data):
+    asgi_app.app.config["RLIMIT_MAX_HITS"] = 1
+    assert post(asgi_app, "/v1", good_data[0]).get_json()["status"] != "fail"
+    assert post(asgi_app, "/v1", good_data[0]).get_json() == {
+        "status": "fail",
+        "message": "You hit the rate limit",
+    }
+    other_client = post(asgi_app, "/v1", good_data[0], client=("10.0.0.2", 40000))
+    assert other_client.get_json()["status"] != "fail"
+
+
+def test_concurrent_requests(asgi_app, fake_redis, good_data):
+    req, cert = good_data
+    fake_redis.set(get_cert_key(req["sn"]), cert)
+    body = json.dumps(req).encode("utf-8")
+
+    async def poll():
+        return await asyncio.gather(*(call(asgi_app, "POST", "/v1", body) for _ in range(500)))
+
+    assert all(rv.get_json()["status"] == "ok" for rv in asyncio.run(poll()))
+
+
+def test_http_errors(asgi_app, good_data):
+    assert asyncio.run(call(asgi_app, "POST", "/v2")).status == 404
+    assert asyncio.run(call(asgi_app, "GET", "/v1/certs")).status == 405
+    assert post(asgi_app, "/v1", good_data[0], content_type="text/plain").status == 415
+    assert asyncio.run(call(asgi_app, "POST", "/v1", b"{")).status == 400
+
+    rv = asyncio.run(call(asgi_app, "GET", "/v1"))
+    assert rv.status == 302
+    assert rv.headers[b"location"] == b"/"
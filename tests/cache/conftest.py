@@ -0,0 +1,21 @@
+import pytest
+
+from certapi.cache import LRUCache
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(clock):
+    return LRUCache(maxsize=2, ttl=10, clock=clock)
@@ -0,0 +1,108 @@
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+from certapi import create_app
+from certapi.cert_cache import get_cert_cache
+
+
+class FakeTrackingHandler(socketserver.StreamRequestHandler):
+    """ Minimal RESP3 server supporting just what the tracking connection
+        needs
+    """
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b"*"
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        self.server.clients.append(self.request)
+        while True:
+            try:
+                command = self.read_command()
+            except (ConnectionError, ValueError):
+                break
+            if command is None:
+                break
+            name = b" ".join(command[:2]).upper()
+            if name.startswith(b"HELLO"):
+                self.request.sendall(b"%1\r\n+proto\r\n:3\r\n")
+            elif name == b"CLIENT TRACKING":
+                self.server.tracking_args = command[2:]
+                self.request.sendall(b"+OK\r\n")
+            elif name.startswith(b"PING"):
+                self.server.pings += 1
+                self.request.sendall(b"+PONG\r\n")
+            else:
+                self.request.sendall(b"+OK\r\n")
+
+
+class FakeTrackingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeTrackingHandler)
+        self.clients = []
+        self.tracking_args = None
+        self.pings = 0
+
+    def invalidate(self, keys):
+        if keys is None:
+            message = b">2\r\n$10\r\ninvalidate\r\n_\r\n"
+        else:
+            message = b">2\r\n$10\r\ninvalidate\r\n*" + str(len(keys)).encode() + b"\r\n"
+            for key in keys:
+                message += b"$" + str(len(key)).encode() + b"\r\n" + key + b"\r\n"
+        for client in self.clients:
+            client.sendall(message)
+
+    def drop_clients(self):
+        while self.clients:
+            client = self.clients.pop()
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def tracking_server():
+    server = FakeTrackingServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.drop_clients()
+    server.server_close()
+
+
+@pytest.fixture
+def cert_cache(tracking_server):
+    app = create_app({
+        "REDIS_CERTS_HOST": "127.0.0.1",
+        "REDIS_CERTS_PORT": tracking_server.server_address[1],
+        "CERT_CACHE_SIZE": 2,
+        "CERT_CACHE_PING_INTERVAL": 0.2,
+    })
+    cache = get_cert_cache(app)
+    cache.token()  # start the tracking
+    wait_for(lambda: cache.connected)
+    yield cache
+    cache.stop()
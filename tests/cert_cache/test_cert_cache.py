@@ -0,0 +1,57 @@
+from .conftest import wait_for
+
+
+def test_tracking_enabled(cert_cache, tracking_server):
+    assert tracking_server.tracking_args == [
+        b"ON", b"BCAST", b"PREFIX", b"certificate:", b"PREFIX", b"certificate_spki:",
+    ]
+
+
+def test_cached(cert_cache):
+    cert_cache.set("sn1", (b"cert", "digest"), cert_cache.token())
+    assert cert_cache.get("sn1") == (b"cert", "digest")
+    assert cert_cache.stats()["hits"] == 1
+
+
+def test_invalidated(cert_cache, tracking_server):
+    cert_cache.set("sn1", (b"cert1", "digest1"), cert_cache.token())
+    cert_cache.set("sn2", (b"cert2", "digest2"), cert_cache.token())
+    tracking_server.invalidate([b"certificate_spki:sn1"])
+    wait_for(lambda: cert_cache.get("sn1") is None)
+    assert cert_cache.get("sn2") == (b"cert2", "digest2")
+
+    tracking_server.invalidate(None)  # FLUSHDB
+    wait_for(lambda: cert_cache.get("sn2") is None)
+
+
+def test_stale_value_not_stored(cert_cache, tracking_server):
+    token = cert_cache.token()  # value fetched from Redis
+    tracking_server.invalidate([b"certificate:sn1"])  # and modified by CA
+    wait_for(lambda: cert_cache.invalidations == 1)
+    cert_cache.set("sn1", (b"old cert", "digest"), token)
+    assert cert_cache.get("sn1") is None
+
+
+def test_eviction(cert_cache):
+    for sn in ("sn1", "sn2", "sn3"):
+        cert_cache.set(sn, (b"cert", "digest"), cert_cache.token())
+    assert cert_cache.get("sn1") is None
+    assert cert_cache.stats()["evictions"] == 1
+
+
+def test_bypassed_while_disconnected(cert_cache, tracking_server):
+    cert_cache.set("sn1", (b"cert", "digest"), cert_cache.token())
+    tracking_server.drop_clients()
+    wait_for(lambda: not cert_cache.connected)
+    assert cert_cache.get("sn1") is None
+    cert_cache.set("sn1", (b"cert", "digest"), cert_cache.token())
+    assert cert_cache.get("sn1") is None
+
+    wait_for(lambda: cert_cache.connected)  # reconnected
+    assert cert_cache.get("sn1") is None
+    assert cert_cache.stats()["reconnects"] == 1
+
+
+def test_ping(cert_cache, tracking_server):
+    wait_for(lambda: tracking_server.pings > 0)
+    assert cert_cache.connected
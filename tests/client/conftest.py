@@ -5,7 +5,8 @@ from unittest.mock import Mock, patch
 
 @pytest.fixture
 def app():
-    yield create_app()
+    # Redis is mocked, queues are not sampled for adaptive delays
+    yield create_app({"POLL_DELAY_SAMPLE_INTERVAL": 0})
 
 
 @pytest.fixture
@@ -31,12 +32,10 @@ def redis_mock():
 
 
 @pytest.fixture
-def redis_pipe_mock():
+def redis_rl_mock():
     redis_inst_mock = Mock()
-    pipe_mock = Mock()
     hits_in_redis = 1
-    pipe_mock.execute.return_value = [None, hits_in_redis, None]
-    redis_inst_mock.pipeline.return_value = pipe_mock
+    redis_inst_mock.register_script.return_value.return_value = hits_in_redis
     with patch("redis.StrictRedis", return_value=redis_inst_mock) as m:
         yield m
 
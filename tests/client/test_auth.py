@@ -1,11 +1,16 @@
 import json
 
+import fakeredis
+import pytest
+from unittest.mock import patch
+
 
 def test_good_req_session_expired(client, good_req_auth_data, redis_mock):
-    redis_mock().get.return_value = None  # Auth session not in redis
+    store_auth = redis_mock().register_script.return_value
+    store_auth.return_value = [1, b""]  # Auth session not in redis
     rv = client.post("/v1", json=good_req_auth_data[0])
-    assert not redis_mock().exists.called  # Do not look for anythong
-    assert redis_mock().get.call_count == 1  # Get auth session
+    assert store_auth.call_count == 1  # Check session & store signature
+    assert not redis_mock().get.called  # Do not look for anything else
     assert not redis_mock().setex.called  # Do not create anythibg
 
     assert rv.status_code == 200
@@ -14,10 +19,11 @@ def test_good_req_session_expired(client, good_req_auth_data, redis_mock):
 
 
 def test_good_req_session_ok(client, redis_mock, good_req_auth_data):
-    redis_mock().get.return_value = json.dumps(good_req_auth_data[1]).encode("utf-8")  # Auth session ok
+    store_auth = redis_mock().register_script.return_value
+    store_auth.return_value = [0, b""]  # Auth session ok
     rv = client.post("/v1", json=good_req_auth_data[0])
-    assert not redis_mock().exists.called  # Do not look for anything
-    assert redis_mock().get.call_count == 1  # Get session
+    assert store_auth.call_count == 1  # Check session & store signature
+    assert not redis_mock().get.called  # Do not look for anything else
     assert not redis_mock().setex.called  # Do not create anythig
 
     assert rv.status_code == 200
@@ -28,7 +34,7 @@ def test_good_req_session_ok(client, redis_mock, good_req_auth_data):
 
 def test_bad_req(client, redis_mock, bad_req_auth):
     rv = client.post("/v1", json=bad_req_auth)
-    assert not redis_mock().exists.called  # Do not look for anything
+    assert not redis_mock().register_script.called  # Do not look for anything
     assert not redis_mock().get.called  # Do not get anything
     assert not redis_mock().setex.called  # Do not create anythig
 
@@ -37,12 +43,62 @@ def test_bad_req(client, redis_mock, bad_req_auth):
     assert resp_data["status"] == "error"
 
 
-def test_good_req_session_broken(client, redis_mock, good_req_auth_data, bad_session):
-    redis_mock().get.return_value = json.dumps(bad_session).encode("utf-8")  # Auth seesion
+@pytest.mark.parametrize("code", [3, 4, 5])  # action, auth type mismatch, already signed
+def test_good_req_session_mismatch(client, redis_mock, good_req_auth_data, code):
+    redis_mock().register_script.return_value.return_value = [code, b""]
     rv = client.post("/v1", json=good_req_auth_data[0])
-    assert not redis_mock().exists.called  # Do not for anything
-    assert redis_mock().get.call_count == 1  # Get session
-    assert not redis_mock().setex.called  # Do not create anythig
+
+    assert rv.status_code == 200
+    resp_data = rv.get_json()
+    assert resp_data["status"] == "fail"
+
+
+@pytest.fixture
+def fake_redis():
+    r = fakeredis.FakeStrictRedis()
+    with patch("redis.StrictRedis", return_value=r):
+        yield r
+
+
+def session_key(req):
+    return "session:{}:{}".format(req["sn"], req["sid"])
+
+
+def test_good_req_session_stored(client, fake_redis, good_req_auth_data):
+    req, session = good_req_auth_data
+    fake_redis.set(session_key(req), json.dumps(session))
+    rv = client.post("/v1", json=req)
+    assert rv.get_json()["status"] == "accepted"
+
+    stored_session = json.loads(fake_redis.get(session_key(req)))
+    assert stored_session == dict(session, signature=req["signature"])
+    assert 0 < fake_redis.ttl(session_key(req)) <= client.application.config["REDIS_SESSION_TIMEOUT"]
+
+    queue = fake_redis.lrange("csr", 0, -1)
+    assert len(queue) == 1
+    auth_request = json.loads(queue[0])
+    assert auth_request.pop("ts") > 0
+    assert auth_request == {
+        "sn": req["sn"],
+        "sid": req["sid"],
+        "nonce": session["nonce"],
+        "signature": req["signature"],
+        "flags": [],
+        "auth_type": session["auth_type"],
+        "csr_str": session["csr_str"],
+    }
+
+    # Duplicate auth request
+    rv = client.post("/v1", json=req)
+    assert rv.get_json()["status"] == "fail"
+    assert fake_redis.llen("csr") == 1
+
+
+def test_good_req_session_broken(client, fake_redis, good_req_auth_data, bad_session):
+    req = good_req_auth_data[0]
+    fake_redis.set(session_key(req), json.dumps(bad_session))  # Auth seesion
+    rv = client.post("/v1", json=req)
+    assert not fake_redis.exists("csr")  # Do not push anything
 
     assert rv.status_code == 200
     resp_data = rv.get_json()
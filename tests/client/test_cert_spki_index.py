@@ -0,0 +1,51 @@
+import fakeredis
+import pytest
+from unittest.mock import patch
+
+from certapi.authentication import get_cert_spki_digest, get_cert_spki_key
+from certapi.crypto import csr_from_str, sha256_hex
+from certapi.validators import RequestContext
+
+from .conftest import good_certs, good_reqs_get_cert
+
+
+@pytest.fixture
+def fake_redis(app):
+    with app.app_context():
+        yield fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture(params=zip(good_reqs_get_cert, good_certs))
+def restore_data(request):
+    req, cert = request.param
+    return req["sn"], cert.encode("utf-8"), RequestContext(csr_from_str(req["csr_str"]))
+
+
+def test_index_filled_on_miss(fake_redis, restore_data):
+    sn, cert_bytes, ctx = restore_data
+    assert get_cert_spki_digest(sn, cert_bytes, None, fake_redis) == sha256_hex(ctx.spki)
+    index = fake_redis.get(get_cert_spki_key(sn))
+    assert index == "{}:{}".format(sha256_hex(cert_bytes), sha256_hex(ctx.spki)).encode("utf-8")
+    assert fake_redis.ttl(get_cert_spki_key(sn)) > 0
+
+
+def test_index_hit_does_not_parse_cert(fake_redis, restore_data):
+    sn, cert_bytes, ctx = restore_data
+    get_cert_spki_digest(sn, cert_bytes, None, fake_redis)
+    index = fake_redis.get(get_cert_spki_key(sn))
+    with patch("certapi.authentication.cert_spki", side_effect=AssertionError):
+        assert get_cert_spki_digest(sn, cert_bytes, index, fake_redis) == sha256_hex(ctx.spki)
+
+
+def test_stale_index(fake_redis, restore_data):
+    sn, cert_bytes, ctx = restore_data
+    stale_index = "{}:{}".format(sha256_hex(b"old cert"), sha256_hex(b"old key")).encode("utf-8")
+    assert get_cert_spki_digest(sn, cert_bytes, stale_index, fake_redis) == sha256_hex(ctx.spki)
+    assert fake_redis.get(get_cert_spki_key(sn)) != stale_index
+
+
+def test_key_mismatch(fake_redis, restore_data):
+    sn, cert_bytes, ctx = restore_data
+    other_ctx = RequestContext(csr_from_str(good_reqs_get_cert[0]["csr_str"]))
+    other_cert = good_certs[1].encode("utf-8")
+    assert get_cert_spki_digest(sn, other_cert, None, fake_redis) != sha256_hex(other_ctx.spki)
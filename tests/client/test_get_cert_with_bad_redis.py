@@ -2,11 +2,11 @@ from certapi.validators import validate_signature, validate_sid, SIGNATURE_LENGT
 
 
 def good_req_sid_useless_cert_broken(client, good_data, redis_mock, bad_cert):
-    redis_mock().exists.return_value = False  # Auth Session not in Redis
-    redis_mock().get.return_value = bad_cert.encode("utf-8")  # BAd cert in redis
+    get_state = redis_mock().register_script.return_value
+    # Auth Session not in Redis, bad cert in redis
+    get_state.return_value = [0, None, [bad_cert.encode("utf-8"), None]]
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 1  # Get cert
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert redis_mock().setex.call_count == 1  # Create auth session
 
     assert rv.status_code == 200
@@ -27,12 +27,12 @@ def test_good_req_sid_empty_cert_broken(client, good_data, redis_mock, bad_cert)
 
 
 def test_good_req_sid_set_auth_broken(client, good_data, redis_mock, bad_auth_state):
-    redis_mock().exists.return_value = True  # Session exists
-    redis_mock().get.return_value = bad_auth_state.encode("utf-8")  # Auth failed
+    get_state = redis_mock().register_script.return_value
+    # Session exists, auth state broken
+    get_state.return_value = [1, bad_auth_state.encode("utf-8"), []]
 
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 1  # Get auth state
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert not redis_mock().setex.called  # Do not set anything
 
     assert rv.status_code == 200
@@ -1,20 +1,24 @@
+from unittest.mock import Mock, patch
+
+from certapi.crypto import csr_from_str, public_key_spki, sha256_hex
 from certapi.validators import validate_signature, validate_sid, SIGNATURE_LENGTH
 
 
-def test_rl_good_renew(client_rl, good_req_get_cert_renew, redis_pipe_mock):
-    redis_pipe_mock().get.return_value = None  # RL record not in Redis
+def test_rl_good_renew(client_rl, good_req_get_cert_renew, redis_rl_mock):
+    rate_limit = redis_rl_mock().register_script.return_value
     # First request - Rate Limit OK
     rv = client_rl.post("/v1", json=good_req_get_cert_renew)
-    assert redis_pipe_mock().get.called  # Look for RL record
+    assert rate_limit.call_count == 1  # Count the hit
 
     assert rv.status_code == 200
     resp_data = rv.get_json()
     assert resp_data["status"] == "authenticate"
 
-    # Third request - Rate Limit Triggered
-    redis_pipe_mock().get.return_value = 2  # RL record not in Redis
+    # Second request - Rate Limit Triggered
+    rate_limit.return_value = 2  # Hits counted in Redis
     rv = client_rl.post("/v1", json=good_req_get_cert_renew)
-    assert redis_pipe_mock().get.called  # Look for RL record
+    assert rate_limit.call_count == 2  # Count the hit
+    assert not redis_rl_mock().get.called  # No other round trip needed
 
     assert rv.status_code == 200
     resp_data = rv.get_json()
@@ -23,7 +27,7 @@ def test_rl_good_renew(client_rl, good_req_get_cert_renew, redis_pipe_mock):
 
 def test_good_renew(client, good_req_get_cert_renew, redis_mock):
     rv = client.post("/v1", json=good_req_get_cert_renew)
-    assert not redis_mock().exists.called  # Do not look for anything
+    assert not redis_mock().register_script.called  # Do not look for anything
     assert not redis_mock().get.called  # Do not look fo anything
     assert redis_mock().setex.call_count == 1  # Create auth session
 
@@ -35,13 +39,12 @@ def test_good_renew(client, good_req_get_cert_renew, redis_mock):
 
 
 def good_sid_useless_cert_missing(client, good_data, redis_mock):
-    redis_mock().exists.return_value = False  # Auth Session not in Redis
-    redis_mock().get.return_value = None  # Cert not in Redis
+    get_state = redis_mock().register_script.return_value
+    get_state.return_value = [0, None, [None, None]]  # Auth Session nor cert in Redis
     #  Now the client gets response "authenticate"
 
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 1  # Get cert
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert redis_mock().setex.call_count == 1  # Create auth session
 
     assert rv.status_code == 200
@@ -62,12 +65,12 @@ def test_good_sid_empty_cert_missing(client, good_data, redis_mock):
 
 
 def good_sid_useless_cert_ok(client, good_data, redis_mock):
-    redis_mock().exists.return_value = False  # Auth Session not in Redis
-    redis_mock().get.return_value = good_data[1].encode("utf-8")  # Cert not in Redis
+    get_state = redis_mock().register_script.return_value
+    # Auth Session not in Redis, cert in Redis
+    get_state.return_value = [0, None, [good_data[1].encode("utf-8"), None]]
     #  Now the client gets response "ok"
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 1  # Get cert
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert not redis_mock().setex.called  # Do not create anything
 
     assert rv.status_code == 200
@@ -87,13 +90,12 @@ def test_good_sid_empty_cert_ok(client, good_data, redis_mock):
 
 
 def test_good_sid_set_auth_in_progress(client, good_data, redis_mock):
-    redis_mock().exists.return_value = True  # Session exists
-    redis_mock().get.return_value = None  # Auth state not in redis
+    get_state = redis_mock().register_script.return_value
+    get_state.return_value = [1, None, []]  # Session exists, auth state not in redis
     #  Now the client gets response "wait" for authentication process result
 
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 1  # Get auth state
+    assert get_state.call_count == 1  # Get session and auth state
     assert not redis_mock().setex.called  # Do not set anything
 
     assert rv.status_code == 200
@@ -103,13 +105,13 @@ def test_good_sid_set_auth_in_progress(client, good_data, redis_mock):
 
 
 def test_good_sid_set_auth_failed(client, good_data, redis_mock):
-    redis_mock().exists.return_value = True  # Session exists
-    redis_mock().get.return_value = b'{"status": "fail", "message": "fail"}'  # Auth failed
+    get_state = redis_mock().register_script.return_value
+    # Session exists, auth failed
+    get_state.return_value = [1, b'{"status": "fail", "message": "fail"}', []]
     #  Now the client gets response "fail"
 
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 1  # Get auth state
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert not redis_mock().setex.called  # Do not set anything
 
     assert rv.status_code == 200
@@ -118,20 +120,18 @@ def test_good_sid_set_auth_failed(client, good_data, redis_mock):
 
 
 def test_good_sid_set_auth_ok_cert_missing(client, good_data, redis_mock):
-    def redis_get(key):
-        if "auth_state:{}:".format(good_data[0]["sn"]) in key:
-            return b'{"status": "ok", "message": null}'
-        if key == "certificate:{}".format(good_data[0]["sn"]):
-            return None
-        assert False
-
-    redis_mock().exists.return_value = True  # Session exists
-    redis_mock().get.side_effect = redis_get  # Auth ok & get cert
+    def redis_get_state(keys):
+        assert keys[1].startswith("auth_state:{}:".format(good_data[0]["sn"]))
+        assert keys[2] == "certificate:{}".format(good_data[0]["sn"])
+        assert keys[3] == "certificate_spki:{}".format(good_data[0]["sn"])
+        return [1, b'{"status": "ok", "message": null}', [None, None]]
+
+    get_state = redis_mock().register_script.return_value
+    get_state.side_effect = redis_get_state  # Session exists, auth ok, cert missing
     #  Now the client gets response "authenticate"
 
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 2  # Get auth state and cert
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert redis_mock().setex.call_count == 1  # Do not set anything
 
     assert rv.status_code == 200
@@ -142,19 +142,17 @@ def test_good_sid_set_auth_ok_cert_missing(client, good_data, redis_mock):
 
 
 def test_good_sid_set_auth_ok_cert_ok(client, good_data, redis_mock):
-    def redis_get(key):
-        if "auth_state:{}:".format(good_data[0]["sn"]) in key:
-            return b'{"status": "ok", "message": null}'
-        if key == "certificate:{}".format(good_data[0]["sn"]):
-            return good_data[1].encode("utf-8")
-        assert False
+    def redis_get_state(keys):
+        assert keys[1].startswith("auth_state:{}:".format(good_data[0]["sn"]))
+        assert keys[2] == "certificate:{}".format(good_data[0]["sn"])
+        assert keys[3] == "certificate_spki:{}".format(good_data[0]["sn"])
+        return [1, b'{"status": "ok", "message": null}', [good_data[1].encode("utf-8"), None]]
 
-    redis_mock().exists.return_value = True  # Session exists
-    redis_mock().get.side_effect = redis_get  # Auth ok & get cert
+    get_state = redis_mock().register_script.return_value
+    get_state.side_effect = redis_get_state  # Session exists, auth ok, cert ok
 
     rv = client.post("/v1", json=good_data[0])
-    assert redis_mock().exists.call_count == 1  # Session exists?
-    assert redis_mock().get.call_count == 2  # Get auth state and cert
+    assert get_state.call_count == 1  # Get session, auth state and cert
     assert not redis_mock().setex.called  # Do not set anything
 
     assert rv.status_code == 200
@@ -168,3 +166,38 @@ def test_bad(client, bad_req_get_cert):
     assert rv.status_code == 200
     resp_data = rv.get_json()
     assert resp_data["status"] == "error"
+
+
+def test_good_sid_set_cert_cached(client, good_data, redis_mock):
+    req, cert = good_data
+    csr_spki = public_key_spki(csr_from_str(req["csr_str"]).public_key())
+    cert_cache = Mock()
+    cert_cache.get.return_value = (cert.encode("utf-8"), sha256_hex(csr_spki))
+
+    get_state = redis_mock().register_script.return_value
+    get_state.return_value = [0, None, []]  # Auth Session not in Redis
+    with patch("certapi.authentication.get_cert_cache", return_value=cert_cache):
+        rv = client.post("/v1", json=req)
+    assert len(get_state.call_args.kwargs["keys"]) == 2  # Do not get cert
+    assert not redis_mock().set.called  # Do not index the cert
+    assert not cert_cache.set.called
+
+    assert rv.status_code == 200
+    resp_data = rv.get_json()
+    assert resp_data["status"] == "ok"
+    assert resp_data["cert"] == cert
+
+
+def test_good_sid_set_cert_not_cached(client, good_data, redis_mock):
+    req, cert = good_data
+    cert_cache = Mock()
+    cert_cache.get.return_value = None
+
+    get_state = redis_mock().register_script.return_value
+    get_state.return_value = [0, None, [cert.encode("utf-8"), None]]
+    with patch("certapi.authentication.get_cert_cache", return_value=cert_cache):
+        rv = client.post("/v1", json=req)
+    assert len(get_state.call_args.kwargs["keys"]) == 4  # Get cert & its SPKI digest
+    assert cert_cache.set.call_count == 1  # Cache the cert
+
+    assert rv.get_json()["status"] == "ok"
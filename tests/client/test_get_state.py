@@ -0,0 +1,39 @@
+import fakeredis
+import pytest
+
+from certapi.authentication import fetch_get_state
+
+SN = "0000000A000001F3"
+SID = "4cca5561cf766855a02ee33f229acf4b144fdb7988abd85fd2bad3cfe2546d9f"
+CERT_KEYS = ("certificate:{}".format(SN), "certificate_spki:{}".format(SN))
+
+
+@pytest.fixture
+def fake_redis():
+    r = fakeredis.FakeStrictRedis()
+    r.set("certificate:{}".format(SN), b"cert")
+    yield r
+
+
+def test_no_session(fake_redis):
+    state = fetch_get_state(SN, SID, CERT_KEYS, fake_redis)
+    assert state == (False, None, [b"cert", None])
+
+
+def test_session_without_auth_state(fake_redis):
+    fake_redis.set("session:{}:{}".format(SN, SID), b"{}")
+    state = fetch_get_state(SN, SID, CERT_KEYS, fake_redis)
+    assert state == (True, None, [None, None])  # cert is not needed to tell the client to wait
+
+
+def test_session_with_auth_state(fake_redis):
+    fake_redis.set("session:{}:{}".format(SN, SID), b"{}")
+    fake_redis.set("auth_state:{}:{}".format(SN, SID), b"state")
+    fake_redis.set("certificate_spki:{}".format(SN), b"index")
+    state = fetch_get_state(SN, SID, CERT_KEYS, fake_redis)
+    assert state == (True, b"state", [b"cert", b"index"])
+
+
+def test_value_missing(fake_redis):
+    state = fetch_get_state(SN, SID, ("mailpass:{}".format(SN),), fake_redis)
+    assert state == (False, None, [None])
@@ -33,19 +33,28 @@ def test_create_random_sid():
     v.validate_sid(sid)
 
 
+def csr_spki(csr_bytes):
+    return c.public_key_spki(c.csr_from_str(csr_bytes.decode("utf-8")).public_key())
+
+
+def test_public_key_spki(good_cert_bytes, good_csr_bytes):
+    cert = c.x509.load_pem_x509_certificate(good_cert_bytes)
+    assert c.public_key_spki(cert.public_key()) == csr_spki(good_csr_bytes)
+
+
 def test_valid_key_match(good_cert_bytes, good_csr_bytes):
-    assert c.key_match(good_cert_bytes, good_csr_bytes)
+    assert c.key_match(good_cert_bytes, csr_spki(good_csr_bytes))
 
 
 def test_different_key_match(good_cert_bytes, swapped_csr_bytes):
-    assert not c.key_match(good_cert_bytes, swapped_csr_bytes)
+    assert not c.key_match(good_cert_bytes, csr_spki(swapped_csr_bytes))
 
 
 def test_invalid_key_match(invalid_cert_bytes, good_csr_bytes):
     with pytest.raises(ValueError):
-        c.key_match(invalid_cert_bytes, good_csr_bytes)
+        c.key_match(invalid_cert_bytes, csr_spki(good_csr_bytes))
 
 
 def test_badlytyped_key_match(bad_format_cert_bytes, good_csr_bytes):
     with pytest.raises(TypeError):
-        c.key_match(bad_format_cert_bytes, good_csr_bytes)
+        c.key_match(bad_format_cert_bytes, csr_spki(good_csr_bytes))
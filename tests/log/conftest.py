@@ -0,0 +1,36 @@
+import logging
+
+import pytest
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record, record.getMessage()))
+
+
+@pytest.fixture
+def collecting_handler():
+    return CollectingHandler()
+
+
+@pytest.fixture
+def logger(collecting_handler):
+    logger = logging.getLogger("certapi.tests.log")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(collecting_handler)
+    yield logger
+    logger.removeHandler(collecting_handler)
+
+
+@pytest.fixture
+def req():
+    return {
+        "sn": "0000000A000001F3",
+        "csr_str": "-----BEGIN CERTIFICATE REQUEST-----\n...",
+        "secret": "tajneheslo",
+    }
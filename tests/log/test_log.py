@@ -0,0 +1,66 @@
+import json
+import logging
+import threading
+from unittest.mock import patch
+
+from certapi.log import BackgroundQueueHandler, LazyJSON, log_sampled
+
+
+def test_lazy_json_summarized(req):
+    data = json.loads(str(LazyJSON(req)))
+    assert data["sn"] == req["sn"]
+    assert data["csr_str"].startswith("<{} chars, sha256 ".format(len(req["csr_str"])))
+    assert data["secret"] == "<secret>"
+
+
+def test_disabled_level_not_serialized(logger, collecting_handler, req):
+    logger.setLevel(logging.INFO)
+    with patch("certapi.log.json.dumps", side_effect=AssertionError):
+        log_sampled(logger, logging.DEBUG, "Request", req)
+    assert not collecting_handler.records
+
+
+def test_logged(logger, collecting_handler, req):
+    log_sampled(logger, logging.DEBUG, "Request", req)
+    record, message = collecting_handler.records[0]
+    assert record.event == "Request"
+    assert message.startswith("Request: {")
+
+
+def test_sampling(logger, collecting_handler, req):
+    rates = {"Request": 0.0, "Reply": 1.0}
+    log_sampled(logger, logging.DEBUG, "Request", req, rates)
+    log_sampled(logger, logging.DEBUG, "Reply", req, rates)
+    log_sampled(logger, logging.DEBUG, "Other", req, rates)
+    assert [r.event for r, _ in collecting_handler.records] == ["Reply", "Other"]
+
+
+def test_background_handler(collecting_handler, req):
+    emitted = threading.Event()
+    threads = []
+
+    def emit(record):
+        threads.append(threading.current_thread())
+        emitted.set()
+
+    collecting_handler.emit = emit
+    handler = BackgroundQueueHandler([collecting_handler])
+    logger = logging.getLogger("certapi.tests.log.background")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        log_sampled(logger, logging.WARNING, "Request", req)
+        assert emitted.wait(5)
+        assert threads[0] is not threading.current_thread()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_background_handler_full_queue(collecting_handler):
+    handler = BackgroundQueueHandler([collecting_handler], maxsize=1)
+    with patch("logging.handlers.QueueListener.start"):  # nothing consumes the queue
+        for _ in range(3):
+            handler.handle(logging.makeLogRecord({"msg": "x"}))
+    assert handler.dropped == 2
+    handler._listener = None
@@ -0,0 +1,48 @@
+import fakeredis
+import pytest
+from unittest.mock import patch
+
+from certapi import create_app
+from certapi.poll_delay import QueueMonitor
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def monitor(clock):
+    return QueueMonitor(sample_interval=5, smoothing=0.5, clock=clock)
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        "RLIMIT_MAX_HITS": 0,
+        "POLL_DELAY_MIN": 2,
+        "POLL_DELAY_MAX": 60,
+        "POLL_DELAY_JITTER": 0,
+    })
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def fake_redis():
+    r = fakeredis.FakeStrictRedis()
+    with patch("redis.StrictRedis", return_value=r):
+        yield r
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from certapi.authentication import get_session_key
+from certapi.poll_delay import EXTENSION_NAME, poll_delay
+from tests.client.conftest import good_reqs_auth, good_reqs_get_cert, good_sessions
+
+
+def test_sampled_once_per_interval(monitor, clock):
+    assert monitor.claim_sample()
+    assert not monitor.claim_sample()
+    clock.now = 5
+    assert monitor.claim_sample()
+
+
+def test_turnaround_unknown(monitor):
+    assert monitor.turnaround() is None
+    monitor.add_sample(10, 100)
+    assert monitor.turnaround() is None  # drain rate needs two samples
+
+
+def test_turnaround(monitor, clock):
+    monitor.add_sample(10, 100)
+    clock.now = 10
+    monitor.add_sample(20, 130)  # 30 pushed, 20 drained in 10 s
+    assert monitor.drain_rate == 2
+    assert monitor.depth == 15
+    assert monitor.turnaround() == 7.5
+
+
+def test_turnaround_empty_queue(monitor, clock):
+    monitor.add_sample(0, 100)
+    clock.now = 10
+    monitor.add_sample(0, 100)
+    assert monitor.turnaround() == 0
+
+
+def test_turnaround_stuck_queue(monitor, clock):
+    monitor.add_sample(10, 100)
+    clock.now = 10
+    monitor.add_sample(10, 100)
+    assert monitor.turnaround() == float("inf")
+
+
+def test_counter_reset(monitor, clock):
+    monitor.add_sample(10, 100)
+    clock.now = 10
+    monitor.add_sample(0, 0)
+    assert monitor.drain_rate is None
+
+
+@pytest.mark.parametrize("turnaround, delay", [
+    (None, 10),
+    (0, 2),
+    (7.4, 7),
+    (float("inf"), 60),
+])
+def test_poll_delay_bounds(turnaround, delay):
+    assert poll_delay(turnaround, 10, 2, 60, 0) == delay
+
+
+def test_poll_delay_jitter():
+    delays = {poll_delay(30, 10, 2, 60, 0.2) for _ in range(1000)}
+    assert min(delays) >= 24
+    assert max(delays) <= 36
+    assert len(delays) > 1
+
+
+def test_auth_counted(client, fake_redis):
+    req, session = good_reqs_auth[0], good_sessions[0]
+    fake_redis.set(get_session_key(req["sn"], req["sid"]), json.dumps(session))
+    rv = client.post("/v1", json=req)
+    assert rv.get_json()["status"] == "accepted"
+    assert int(fake_redis.get("queue_pushed:csr")) == 1
+
+
+def test_wait_delay_follows_backlog(app, client, fake_redis, monitor, clock):
+    app.extensions[EXTENSION_NAME]["csr"] = monitor
+    req = good_reqs_get_cert[0]
+    fake_redis.set(get_session_key(req["sn"], req["sid"]), b"{}")
+
+    fake_redis.lpush("csr", *range(10))
+    fake_redis.set("queue_pushed:csr", 100)
+    assert client.post("/v1", json=req).get_json()["delay"] == 10  # not known yet
+
+    clock.now = 5
+    fake_redis.ltrim("csr", 0, 1)  # 8 items drained in 5 s
+    assert client.post("/v1", json=req).get_json()["delay"] == 4  # 6 items at 1.6 items/s
+
+    fake_redis.lpush("csr", *range(100))
+    fake_redis.set("queue_pushed:csr", 200)
+    assert client.post("/v1", json=req).get_json()["delay"] == 4  # sampled once per interval
+    clock.now = 10
+    assert client.post("/v1", json=req).get_json()["delay"] == 60  # nothing drained, over max
@@ -0,0 +1,15 @@
+import pytest
+from certapi import create_app
+
+
+@pytest.fixture
+def shared_app():
+    yield create_app()
+
+
+@pytest.fixture
+def split_app():
+    yield create_app({
+        "REDIS_MAILPASS_HOST": "redis.example.org",
+        "REDIS_CERTS_UNIX_SOCKET_PATH": "/run/redis/redis.sock",
+    })
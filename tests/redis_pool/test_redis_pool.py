@@ -0,0 +1,40 @@
+import redis
+
+from certapi.redis_pool import get_redis_pools
+
+
+def test_shared_pool(shared_app):
+    pools = get_redis_pools(shared_app)
+    assert pools.get("REDIS_CERTS_") is pools.get("REDIS_MAILPASS_")
+
+
+def test_split_pools(split_app):
+    pools = get_redis_pools(split_app)
+    certs_pool = pools.get("REDIS_CERTS_")
+    mailpass_pool = pools.get("REDIS_MAILPASS_")
+    assert certs_pool is not mailpass_pool
+    assert certs_pool.connection_class is redis.UnixDomainSocketConnection
+    assert certs_pool.connection_kwargs["path"] == "/run/redis/redis.sock"
+    assert mailpass_pool.connection_kwargs["host"] == "redis.example.org"
+    assert mailpass_pool.connection_kwargs["socket_keepalive"]
+
+
+def test_pool_reused(shared_app):
+    pools = get_redis_pools(shared_app)
+    assert pools.get("REDIS_CERTS_") is pools.get("REDIS_CERTS_")
+
+
+def test_pool_recreated_after_fork(shared_app):
+    pools = get_redis_pools(shared_app)
+    pool = pools.get("REDIS_CERTS_")
+    pools._pid = -1  # pretend we are in a forked child
+    assert pools.get("REDIS_CERTS_") is not pool
+
+
+def test_pool_stats(shared_app):
+    pools = get_redis_pools(shared_app)
+    pools.get("REDIS_CERTS_")
+    stats = pools.stats()["REDIS_CERTS_"]
+    assert stats["max_connections"] == shared_app.config["REDIS_MAX_CONNECTIONS"]
+    assert stats["created_connections"] == 0
+    assert stats["in_use_connections"] == 0
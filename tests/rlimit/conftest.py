@@ -0,0 +1,24 @@
+import fakeredis
+import pytest
+from certapi import create_app
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        "RLIMIT_MAX_HITS": 3,
+        "RLIMIT_WINDOW_TIME": 600,
+        "RLIMIT_BAN_TIME": 7200,
+    })
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def fake_redis():
+    yield fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture(params=["10.0.0.1", "2001:db8::1"])
+def remote_addr(request):
+    return request.param
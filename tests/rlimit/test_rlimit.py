@@ -0,0 +1,56 @@
+import pytest
+
+import certapi.exceptions as ex
+import certapi.rlimit as rl
+
+
+def test_hits_within_limit(app, fake_redis, remote_addr):
+    for _ in range(3):
+        rl.check_rate_limit(fake_redis, remote_addr)
+    assert int(fake_redis.get(rl.get_rate_limit_key(remote_addr))) == 3
+
+
+def test_window_not_prolonged(app, fake_redis, remote_addr):
+    key = rl.get_rate_limit_key(remote_addr)
+    rl.check_rate_limit(fake_redis, remote_addr)
+    fake_redis.expire(key, 100)  # time passes
+    rl.check_rate_limit(fake_redis, remote_addr)
+    assert fake_redis.ttl(key) <= 100
+
+
+def test_window_set_on_key_without_ttl(app, fake_redis, remote_addr):
+    key = rl.get_rate_limit_key(remote_addr)
+    fake_redis.set(key, 1)
+    rl.check_rate_limit(fake_redis, remote_addr)
+    assert 0 < fake_redis.ttl(key) <= 600
+
+
+def test_ban(app, fake_redis, remote_addr):
+    key = rl.get_rate_limit_key(remote_addr)
+    for _ in range(3):
+        rl.check_rate_limit(fake_redis, remote_addr)
+    with pytest.raises(ex.RequestProcessError):
+        rl.check_rate_limit(fake_redis, remote_addr)
+    assert 600 < fake_redis.ttl(key) <= 7200
+
+    # requests during the ban are denied and do not prolong it
+    fake_redis.expire(key, 1000)
+    with pytest.raises(ex.RequestProcessError):
+        rl.check_rate_limit(fake_redis, remote_addr)
+    assert fake_redis.ttl(key) <= 1000
+    assert int(fake_redis.get(key)) == 4
+
+
+def test_same_result_as_legacy(app, fake_redis, remote_addr):
+    for _ in range(5):
+        try:
+            rl.check_rate_limit_legacy(fake_redis, "legacy")
+            legacy = "ok"
+        except ex.RequestProcessError:
+            legacy = "fail"
+        try:
+            rl.check_rate_limit(fake_redis, remote_addr)
+            scripted = "ok"
+        except ex.RequestProcessError:
+            scripted = "fail"
+        assert legacy == scripted
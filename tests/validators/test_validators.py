@@ -1,8 +1,10 @@
 import pytest
+from unittest.mock import patch
 
 import certapi.crypto as c
 import certapi.validators as v
 import certapi.exceptions as ex
+from certapi.cache import LRUCache
 
 
 def test_valid_sn_atsha(good_sn_atsha):
@@ -34,7 +36,14 @@ def test_valid_csr_signature(good_csr):
 
 
 def test_valid_csr(good_csr, good_sn_atsha):
-    v.validate_csr(good_csr, good_sn_atsha)
+    csr = v.validate_csr(good_csr, good_sn_atsha)
+    assert csr.public_key() == c.csr_from_str(good_csr).public_key()
+
+
+def test_request_context(good_csr):
+    ctx = v.RequestContext(c.csr_from_str(good_csr))
+    assert ctx.public_key == ctx.csr.public_key()
+    assert ctx.spki == c.public_key_spki(ctx.public_key)
 
 
 def test_invalid_csr(bad_csr, bad_sn_atsha):
@@ -42,6 +51,29 @@ def test_invalid_csr(bad_csr, bad_sn_atsha):
         v.validate_csr(bad_csr, bad_sn_atsha)
 
 
+def test_valid_csr_cached(good_csr, good_sn_atsha):
+    cache = LRUCache(10, 60)
+    csr = v.validate_csr(good_csr, good_sn_atsha, cache)
+    with patch("certapi.validators.csr_from_str", side_effect=AssertionError):
+        assert v.validate_csr(good_csr, good_sn_atsha, cache) is csr
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_invalid_csr_cached(good_csr, wrong_sn_b2b):
+    cache = LRUCache(10, 60)
+    for _ in range(2):
+        with pytest.raises(ex.RequestConsistencyError):
+            v.validate_csr(good_csr, wrong_sn_b2b, cache)
+    assert cache.stats()["hits"] == 1
+
+
+def test_invalid_csr_with_cache(bad_csr, bad_sn_atsha):
+    cache = LRUCache(10, 60)
+    with pytest.raises(ex.RequestConsistencyError):
+        v.validate_csr(bad_csr, bad_sn_atsha, cache)
+
+
 def test_valid_flags(good_certs_flags):
     v.validate_certs_flags(good_certs_flags)
 